@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageFont
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache with hit/miss counters.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        """
+        Return the cached value for key, calling factory() to build it on a miss.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = factory()
+        self.put(key, value)
+        return value
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for key (counting a hit or miss), or default.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+_fonts = LRUCache(16)
+_backgrounds = LRUCache(4)
+_metrics = LRUCache(4096)
+
+
+def file_key(path):
+    """
+    Identify a file by absolute path, modification time and size, so edits
+    to the file on disk invalidate anything cached from it. Names that are
+    not files on disk (e.g. 'arial.ttf', resolved by FreeType) are used as-is.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return (path, None, None)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _open_font(font_path, font_size):
+    if not font_path:
+        return ImageFont.load_default()
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+def load_font(font_path, font_size):
+    """
+    Return a cached font. A missing path gives Pillow's default font, as does
+    a font that fails to load (the failure is cached too, so it is not retried).
+    """
+    key = (file_key(font_path), font_size)
+    return _fonts.get_or_create(key, lambda: _open_font(font_path, font_size))
+
+
+def text_size(text, font_path, font_size):
+    """
+    Return the cached (width, height) of text's bounding box in the given font.
+    """
+    key = (file_key(font_path), font_size, text)
+
+    def measure():
+        bbox = load_font(font_path, font_size).getbbox(text)
+        return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    return _metrics.get_or_create(key, measure)
+
+
+def load_background(path):
+    """
+    Return a cached, decoded RGB copy of a background image.
+    The result is shared: paste onto a .copy() of it, never onto it directly.
+    """
+    def decode():
+        with Image.open(path) as img:
+            return img.convert('RGB')
+
+    return _backgrounds.get_or_create(file_key(path), decode)
+
+
+def cache_stats():
+    """
+    Hit/miss counters for each asset cache in this process.
+    """
+    return {'fonts': _fonts.stats(),
+            'backgrounds': _backgrounds.stats(),
+            'metrics': _metrics.stats()}
+
+
+def clear_caches():
+    for cache in (_fonts, _backgrounds, _metrics):
+        cache.clear()
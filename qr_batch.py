@@ -1,74 +1,253 @@
 import os
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
 
-def read_input_file(path):
+import qr_profile
+import qr_verify
+from qr_encode import ENCODERS, make_qr
+from qr_input import parse_column, read_input_file
+from qr_render import COLOR_MODES, RENDERERS, render_qr
+from qr_shard import SUBDIR_LAYOUTS, parse_shard, place_jobs, select_shard
+from qr_sheet import SheetLayout, SheetPDFWriter, parse_grid, parse_page_size, sheet_label
+from qr_sinks import SINKS, WRITER_THREADS
+from qr_template import label_template
+from qr_vector import VECTOR_FORMATS, vector_label
+
+def make_label_image(data, size=300, font_path=None, renderer='auto', encoder='fit',
+                     color_mode='RGB', verify=False):
+    # Generate the QR (NEAREST keeps module edges sharp on every backend)
+    qr = make_qr(data, border=1, encoder=encoder)
+    img_qr = render_qr(qr, size, renderer, bilevel=color_mode == '1')
+
+    # Stamp it and the label text onto a copy of the style's blank canvas
+    template = label_template(size=size, font_size=14, font_path=font_path, text_gap=5,
+                              text_margin_bottom=5, color_mode=color_mode)
+    canvas = template.render(img_qr, data)
+    if verify:
+        # Sample the module centres back out of the finished label
+        qr_verify.expect(canvas, qr.get_matrix(), size, border=qr.border)
+    return canvas
+
+def make_label_vector(data, out_path=None, fmt='SVG', size=300, font_path=None, encoder='fit'):
+    # Same layout as make_label_image, as SVG or PDF bytes
+    return vector_label(data, fmt=fmt, size=size, font_size=14, font_path=font_path,
+                        text_gap=5, text_margin_bottom=5, border=1, encoder=encoder)
+
+def make_qr_with_label(data, out_path, fmt='JPEG', size=300, font_path=None,
+                       renderer='auto', encoder='fit', vector=False, color_mode='RGB'):
+    # SVG is always vector; vector=True also writes PDFs as paths and text
+    if vector or fmt.upper() == 'SVG':
+        with open(out_path, 'wb') as f:
+            f.write(make_label_vector(data, out_path, fmt, size, font_path, encoder))
+        return
+    canvas = make_label_image(data, size, font_path, renderer, encoder, color_mode)
+    with qr_profile.stage("save"):
+        canvas.save(out_path, fmt)
+
+def iter_jobs(lines, fmt):
     """
-    Reads a text file, auto-detecting BOMs for UTF-8 with BOM or UTF-16.
-    Falls back to Latin-1 if those fail.
-    Returns a list of lines without newline chars.
+    Turn input lines into (index, data, name) jobs for the batch engine, where
+    name is the output file name within the sink (qr_{index}.{ext}).
+    Blank lines are skipped but still consume an index, so names stay stable.
     """
-    import codecs
-
-    # Try UTF-8 (with BOM)
-    try:
-        with codecs.open(path, encoding='utf-8-sig') as f:
-            return f.read().splitlines()
-    except UnicodeError:
-        pass
-
-    # Try UTF-16 (LE or BE)
-    try:
-        with codecs.open(path, encoding='utf-16') as f:
-            return f.read().splitlines()
-    except UnicodeError:
-        pass
-
-    # Fallback
-    with open(path, encoding='latin-1') as f:
-        return [line.rstrip('\r\n') for line in f]
-
-def make_qr_with_label(data, out_path, fmt='JPEG', size=300, font_path=None):
-    # Generate the QR
-    qr = qrcode.QRCode(border=1)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-    img_qr = img_qr.resize((size, size))
-
-    # Prepare canvas with space for text
-    font = ImageFont.load_default() if not font_path else ImageFont.truetype(font_path, 14)
-    mask = font.getmask(data)
-    text_w, text_h = mask.size
-    canvas = Image.new("RGB", (size, size + text_h + 10), "white")
-    canvas.paste(img_qr, (0, 0))
-
-    # Draw the label
-    draw = ImageDraw.Draw(canvas)
-    x = (size - text_w) // 2
-    y = size + 5
-    draw.text((x, y), data, font=font, fill="black")
-
-    # Save
-    canvas.save(out_path, fmt)
+    ext = fmt.lower()
+    for i, data in enumerate(lines):
+        data = data.strip()
+        if not data:
+            continue
+        yield i, data, f"qr_{i}.{ext}"
 
 if __name__ == "__main__":
     import argparse
+    import multiprocessing
+    import sys
+    import time
+
+    from qr_engine import BatchRun, default_workers, label_render
+
+    multiprocessing.freeze_support()
 
     parser = argparse.ArgumentParser(description="Batch-generate QR codes with labels")
     parser.add_argument("input_file", help="TXT or CSV (one value per line)")
-    parser.add_argument("output_dir", help="Where to write images")
-    parser.add_argument("--format", choices=["JPEG","PNG","PDF"], default="JPEG")
+    parser.add_argument("output_dir", help="Where to write images: a folder, or the archive/stream "
+                                           "file for --sink zip/tar/stream ('-' for stdout)")
+    parser.add_argument("--format", choices=["JPEG","PNG","PDF","SVG"], default="JPEG",
+                        help="Output format; SVG is always vector (default: JPEG)")
+    parser.add_argument("--vector", action="store_true",
+                        help="Write PDFs as vector art (module paths and a text label) "
+                             "instead of an embedded image")
+    parser.add_argument("--sink", choices=SINKS, default="dir",
+                        help="dir: one file per code (default); zip/tar: a single uncompressed "
+                             "archive; stream: length-prefixed records for piping")
+    parser.add_argument("--renderer", choices=RENDERERS, default="auto",
+                        help="QR rasterizer: numpy (fast, needs NumPy), pil, or auto (default)")
+    parser.add_argument("--color-mode", choices=COLOR_MODES, default="RGB",
+                        help="Canvas mode: RGB (default), L for grayscale, or 1 for one bit "
+                             "per pixel (bit-depth-1 PNGs, grayscale JPEGs)")
+    parser.add_argument("--encoder", choices=ENCODERS, default="fit",
+                        help="fit: full version/mask search per item (default); "
+                             "sequence: pin version and mask per payload shape, for "
+                             "fixed-width serials; sequence-remask: pin the version but "
+                             "re-choose the mask per item")
+    parser.add_argument("--column", type=parse_column, default=None,
+                        help="Read this CSV column (0-based index or header name) instead of whole lines")
+    parser.add_argument("--skip-header", action="store_true",
+                        help="Skip the first row of the input")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N",
+                        help="Only render shard i of N (1-based): items are dealt out "
+                             "round-robin, so N machines running 1/N..N/N split the job "
+                             "with no overlap and the same file names as a single run")
+    parser.add_argument("--subdirs", choices=SUBDIR_LAYOUTS, default="none",
+                        help="Spread outputs over subfolders: hash (256 folders by file "
+                             "name) or range (folders of 1000 consecutive items); "
+                             "default: none")
+    parser.add_argument("--sheet", type=parse_grid, metavar="ROWSxCOLS",
+                        help="Lay labels out ROWSxCOLS per page in multi-page PDF(s) "
+                             "instead of writing one file per code")
+    parser.add_argument("--page-size", type=parse_page_size, default="A4",
+                        help="Sheet page size: A3, A4, A5, Letter, Legal or WxH in mm (default: A4)")
+    parser.add_argument("--gutter", type=float, default=2.0,
+                        help="Space between labels on a sheet, in mm (default: 2)")
+    parser.add_argument("--bleed", type=float, default=0.0,
+                        help="Bleed added around each sheet page, in mm (default: 0)")
+    parser.add_argument("--page-margin", type=float, default=10.0,
+                        help="Margin inside each sheet page, in mm (default: 10)")
+    parser.add_argument("--pages-per-file", type=int, default=None,
+                        help="Start a new sheet PDF after this many pages")
+    parser.add_argument("--max-file-mb", type=float, default=None,
+                        help="Start a new sheet PDF once a file exceeds this size")
+    parser.add_argument("--manifest", nargs="?", const="", metavar="PATH",
+                        help="Record every output (data, style, content hash, status, errors) in a "
+                             "CSV manifest (default: <output_dir>/manifest.csv, or "
+                             "manifest-<i>of<N>.csv with --shard); with --sink dir, "
+                             "re-runs skip outputs that are already up to date")
+    parser.add_argument("--force", action="store_true",
+                        help="With --manifest, re-render everything instead of skipping")
+    parser.add_argument("--dedup", nargs="?", const="bytes", choices=["bytes", "link"],
+                        help="Render each repeated value once: 'bytes' (default) reuses the "
+                             "encoded output, 'link' also writes repeats as reflinks or "
+                             "hardlinks where the file system supports it (--sink dir)")
+    parser.add_argument("--verify", nargs="?", const="image", choices=qr_verify.VERIFY_MODES,
+                        help="Check every label's QR modules against the encoded matrix "
+                             "(needs NumPy): 'image' (default) samples the rendered image "
+                             "before it is saved, 'reload' also decodes the encoded PNG/JPEG; "
+                             "failures are reported as errors and not written")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Time each stage (encode, mask, rasterize, text, compose, image "
+                             "encode, write, ...) across all workers and save totals and "
+                             "histograms as JSON")
+    parser.add_argument("--cprofile", metavar="PATH",
+                        help="Also save a cProfile dump of this process (use with --workers 1 "
+                             "to include rendering)")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Worker processes (default: one per CPU core; 1 disables the pool)")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="Items sent to a worker at a time (default: 64)")
+    parser.add_argument("--writers", type=int, default=WRITER_THREADS,
+                        help="Background threads that encode and save outputs while the next "
+                             f"ones render (default: {WRITER_THREADS}; 0 saves inline)")
     args = parser.parse_args()
+    if args.manifest is not None and args.sheet:
+        parser.error("--manifest is not supported with --sheet")
+    if args.subdirs != "none" and args.sheet:
+        parser.error("--subdirs is not supported with --sheet")
+    vector = args.vector or args.format == "SVG"
+    if vector and (args.sheet or args.format not in VECTOR_FORMATS):
+        parser.error("vector output needs --format PDF or SVG and no --sheet")
+    if args.verify and vector:
+        parser.error("--verify checks raster output; vector output is not supported")
+    if args.verify and not qr_verify.available():
+        parser.error("--verify needs NumPy")
+    if isinstance(args.column, str):
+        # Header names are only looked up once reading starts; check before anything is written
+        try:
+            next(read_input_file(args.input_file, column=args.column), None)
+        except ValueError as e:
+            parser.error(f"--column: {e}")
 
-    os.makedirs(args.output_dir, exist_ok=True)
-    lines = read_input_file(args.input_file)
+    # Keep stdout clean when the images themselves are streamed there
+    log = sys.stderr if args.sink == "stream" and args.output_dir == "-" else sys.stdout
+    lines = read_input_file(args.input_file, column=args.column,
+                            skip_header=args.skip_header)
+    jobs = iter_jobs(lines, args.format)
+    if args.shard:
+        jobs = select_shard(jobs, *args.shard)
+    jobs = place_jobs(jobs, args.subdirs)
 
-    for i, data in enumerate(lines):
-        data = data.strip()
-        if not data:
-            continue
-        filename = f"qr_{i}.{args.format.lower()}"
-        out_path = os.path.join(args.output_dir, filename)
-        make_qr_with_label(data, out_path, fmt=args.format)
-        print(f"Generated {filename}")
+    options = {"renderer": args.renderer, "encoder": args.encoder,
+               "color_mode": args.color_mode, "image_func": make_label_image}
+    sheet = None
+    if args.sheet:
+        # Sheet mode: workers return encoded labels, placed here onto shared pages
+        os.makedirs(args.output_dir, exist_ok=True)
+        layout = SheetLayout(args.page_size, *args.sheet, gutter=args.gutter,
+                             bleed=args.bleed, margin=args.page_margin)
+        max_bytes = int(args.max_file_mb * 1024 * 1024) if args.max_file_mb else None
+        sheet = SheetPDFWriter(os.path.join(args.output_dir, "labels.pdf"), layout,
+                               max_pages=args.pages_per_file, max_bytes=max_bytes)
+        render = sheet_label
+    elif vector:
+        # Workers return finished SVG/PDF documents; the sink writes them here
+        render = make_label_vector
+        options = {"fmt": args.format, "encoder": args.encoder}
+    else:
+        # Workers return the image or its encoded bytes; the sink writes them here
+        render = label_render(args.workers, args.writers, args.dedup, args.verify)
+        options["fmt"] = args.format
+
+    manifest_path = None
+    if args.manifest is not None:
+        # Shards often share one output folder, so each keeps a manifest of its own
+        name = "manifest-{}of{}.csv".format(*args.shard) if args.shard else "manifest.csv"
+        if args.manifest:
+            manifest_path = args.manifest
+        elif args.sink == "dir":
+            manifest_path = os.path.join(args.output_dir, name)
+        else:
+            manifest_path = os.path.splitext(args.output_dir)[0] + "." + name
+    batch = BatchRun(render, options, args.output_dir, args.sink, sheet=sheet, fmt=args.format,
+                     manifest=manifest_path, force=args.force, dedup=args.dedup,
+                     verify=args.verify, writers=args.writers)
+
+    def report(i, name, error):
+        if error:
+            print(f"Failed qr_{i}: {error}", file=sys.stderr)
+        elif not sheet:
+            print(f"Generated {name}", file=log)
+
+    started = time.perf_counter()
+    if args.profile or args.cprofile:
+        qr_profile.enable()
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    batch.run(jobs, workers=args.workers, chunk_size=args.chunk_size, on_result=report)
+    for note in batch.notes():
+        print(note, file=log)
+
+    if sheet:
+        with qr_profile.stage("write"):
+            paths = sheet.close()
+        for path in paths:
+            print(f"Generated {os.path.basename(path)}", file=log)
+        print(f"{sheet.pages} page(s) of {layout.rows}x{layout.cols} labels", file=log)
+
+    if args.cprofile:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+        print(f"Saved cProfile stats to {args.cprofile}", file=log)
+    if qr_profile.enabled():
+        print(qr_profile.format_summary(), file=log)
+        if args.profile:
+            qr_profile.write_report(args.profile, time.perf_counter() - started,
+                                    argv=sys.argv[1:], workers=args.workers)
+            print(f"Saved stage timings to {args.profile}", file=log)
+
+    if args.verify:
+        if batch.unverified:
+            print(f"{batch.unverified} item(s) failed verification", file=sys.stderr)
+        else:
+            print("All rendered items passed verification", file=log)
+    if batch.failed:
+        print(f"{batch.failed} item(s) failed", file=sys.stderr)
+        sys.exit(1)
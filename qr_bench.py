@@ -0,0 +1,350 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PAYLOAD_LENGTHS = (8, 32, 128, 512)
+SIZES = (300, 800)
+ENCODINGS = ('utf-8', 'utf-8-sig', 'utf-16', 'latin-1')
+FORMATS = ('JPEG', 'PNG', 'PDF', 'SVG')
+SUITES = ('render', 'modes', 'read', 'batch')
+
+
+def payload(i, length):
+    """
+    Deterministic alphanumeric payload of exactly length characters.
+    """
+    return f'ITEM-{i:08d}-'.ljust(length, 'Q')[:length] if length >= 14 else f'{i:0{length}d}'
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def peak_rss_kb(usage=None):
+    """
+    Peak resident set size in KB from a resource.struct_rusage (this process
+    when omitted), or None where the resource module is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = usage or resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is bytes on macOS, KB elsewhere
+    return usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+
+
+def time_calls(func, args_list):
+    """
+    Call func(*args) for each args tuple; return latency stats and throughput.
+    """
+    timings = []
+    start = time.perf_counter()
+    for args in args_list:
+        t0 = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    timings.sort()
+    return {
+        'n': len(timings),
+        'p50_ms': percentile(timings, 50) * 1e3,
+        'p90_ms': percentile(timings, 90) * 1e3,
+        'p99_ms': percentile(timings, 99) * 1e3,
+        'mean_ms': total / len(timings) * 1e3,
+        'items_per_s': len(timings) / total,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def bench_render(results, repeat, tmpdir):
+    """
+    create_qr_image, compose_image (label templates) and both make_qr_with_label
+    variants across payload lengths and sizes.
+    """
+    import qr_batch
+    import qr_label
+
+    for length in PAYLOAD_LENGTHS:
+        for size in SIZES:
+            items = [payload(i, length) for i in range(repeat)]
+            tag = f'len{length}/size{size}'
+            results[f'create_qr_image/{tag}'] = time_calls(
+                lambda d: qr_label.create_qr_image(d, size=size),
+                [(d,) for d in items])
+            results[f'compose_image/{tag}'] = time_calls(
+                lambda d: qr_label.compose_image(d, size=size),
+                [(d,) for d in items])
+            out = os.path.join(tmpdir, 'tk.png')
+            results[f'tk.make_qr_with_label/{tag}'] = time_calls(
+                lambda d: qr_label.make_qr_with_label(d, out, 'PNG', size=size),
+                [(d,) for d in items])
+            out = os.path.join(tmpdir, 'batch.png')
+            results[f'batch.make_qr_with_label/{tag}'] = time_calls(
+                lambda d: qr_batch.make_qr_with_label(d, out, 'PNG', size=size),
+                [(d,) for d in items])
+
+
+def bench_color_modes(results, repeat):
+    """
+    Label rendering and encoding in each color mode, with the mean output size.
+    """
+    import qr_batch
+    from qr_render import COLOR_MODES
+    from qr_sinks import image_bytes
+
+    items = [payload(i, 32) for i in range(repeat)]
+    for mode in COLOR_MODES:
+        for fmt in ('PNG', 'JPEG'):
+            sizes = []
+            stats = time_calls(
+                lambda d: sizes.append(len(image_bytes(
+                    qr_batch.make_label_image(d, 300, color_mode=mode), fmt))),
+                [(d,) for d in items])
+            stats['mean_bytes'] = sum(sizes) / len(sizes)
+            results[f'color_mode/{mode}/{fmt}'] = stats
+
+
+def write_input(path, rows, encoding):
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        for i in range(rows):
+            f.write(f'{i},ITEM-{i:08d},Zoë\r\n')
+
+
+def bench_read(results, rows, tmpdir):
+    """
+    read_input_file over synthetic files in each supported encoding.
+    """
+    from qr_input import read_input_file
+
+    for encoding in ENCODINGS:
+        path = os.path.join(tmpdir, f'input-{encoding}.csv')
+        write_input(path, rows, encoding)
+        for label, kwargs in (('lines', {}), ('column', {'column': 1})):
+            stats = time_calls(lambda: sum(1 for _ in read_input_file(path, **kwargs)),
+                               [()] * 3)
+            stats['items_per_s'] = rows / (stats['mean_ms'] / 1e3)
+            results[f'read_input_file/{encoding}/{label}'] = stats
+
+
+def run_child(cmd):
+    """
+    Run a command, returning (seconds, peak RSS of that child in KB or None).
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                           else -os.WTERMSIG(status))
+        rss = peak_rss_kb(usage)
+    else:
+        proc.wait()
+        rss = None
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f'{" ".join(cmd)} failed: {proc.stderr.read().decode(errors="replace")}')
+    return elapsed, rss
+
+
+def bench_batches(results, counts, workers, tmpdir):
+    """
+    End-to-end qr_batch.py runs (process start-up included) for each format.
+    """
+    for count in counts:
+        path = os.path.join(tmpdir, f'batch-{count}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(f'SN-{i:07d}\n' for i in range(count))
+        for fmt in FORMATS:
+            outdir = os.path.join(tmpdir, f'out-{fmt}-{count}')
+            cmd = [sys.executable, os.path.join(HERE, 'qr_batch.py'), path, outdir,
+                   '--format', fmt, '--workers', str(workers)]
+            elapsed, rss = run_child(cmd)
+            results[f'batch/{fmt}/{count}'] = {
+                'n': count,
+                'seconds': elapsed,
+                'items_per_s': count / elapsed,
+                'peak_rss_kb': rss,
+            }
+
+
+def check_templates(count, fonts=(None,), seed=0):
+    """
+    Render random labels both through the label templates (as compose_image
+    does) and from scratch (create_qr_image pasted onto the background), and
+    return a description of each label whose pixels differ. Styles include
+    negative margins, backgrounds the label runs off, text wider than the
+    label, constant prefixes/suffixes and every color mode.
+    """
+    import random
+
+    from PIL import Image
+
+    from qr_assets import load_background
+    from qr_encode import make_qr
+    from qr_label import create_qr_image
+    from qr_render import COLOR_MODES, render_qr
+    from qr_template import label_template
+
+    rng = random.Random(seed)
+    failures = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bg_file = os.path.join(tmpdir, 'bg.png')
+        Image.effect_noise((400, 500), 60).convert('RGB').save(bg_file)
+        for i in range(count):
+            style = {
+                'size': rng.choice((80, 150, 240)),
+                'qr_margin': rng.choice((-20, -7, -1, 0, 7, 30)),
+                'font_size': rng.choice((10, 14, 23)),
+                'font_path': rng.choice(fonts),
+                'text_margin_bottom': rng.choice((0, 10)),
+                'bg_file': rng.choice(('', bg_file)),
+                'bg_offset': rng.choice(((0, 0), (30, 40), (-25, 10), (350, 470))),
+                'color_mode': rng.choice(COLOR_MODES),
+            }
+            prefix, suffix = rng.choice((('', ''), ('ITEM-', ''), ('A', '-fj'), ('(', ') x')))
+            middle = ''.join(rng.choice('0123456789 AjgyWÉ_-|') for _ in range(rng.randint(1, 30)))
+            text = prefix + middle + suffix
+
+            qr = make_qr(text, border=2)
+            img_qr = render_qr(qr, style['size'], 'auto', bilevel=style['color_mode'] == '1')
+            template = label_template(**{**style, 'font_path': style['font_path'] or 'arial.ttf'})
+            got = template.render(img_qr, text, prefix, suffix)
+            want = create_qr_image(text, style['size'], style['qr_margin'], style['font_size'],
+                                   style['font_path'], style['text_margin_bottom'],
+                                   color_mode=style['color_mode'])
+            if style['bg_file']:
+                label, want = want, load_background(bg_file).copy()
+                want.paste(label, style['bg_offset'])
+            if (got.mode, got.size, got.tobytes()) != (want.mode, want.size, want.tobytes()):
+                failures.append(f'{text!r} prefix={prefix!r} suffix={suffix!r} {style}')
+    return failures
+
+
+def environment():
+    import PIL
+    import qrcode
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    try:
+        from importlib.metadata import version
+        qrcode_version = version('qrcode')
+    except Exception:
+        qrcode_version = getattr(qrcode, '__version__', None)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'qrcode': qrcode_version,
+        'numpy': numpy_version,
+    }
+
+
+def run(args):
+    results = {}
+    suites = set(args.suite or SUITES)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if 'render' in suites:
+            bench_render(results, 20 if args.quick else 200, tmpdir)
+        if 'modes' in suites:
+            bench_color_modes(results, 20 if args.quick else 200)
+        if 'read' in suites:
+            bench_read(results, 20_000 if args.quick else 200_000, tmpdir)
+        if 'batch' in suites:
+            bench_batches(results, (1000,) if args.quick else (1000, 10_000),
+                          args.workers, tmpdir)
+    report = {'meta': environment(), 'results': results}
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    for name, stats in sorted(results.items()):
+        p50 = f'{stats["p50_ms"]:9.2f} ms p50' if 'p50_ms' in stats else ' ' * 16
+        print(f'{name:45s} {p50} {stats["items_per_s"]:12,.0f} items/s')
+    print(f'Wrote {args.out}')
+    return 0
+
+
+# Metric -> True when a higher value is better
+COMPARED_METRICS = {'p50_ms': False, 'p90_ms': False, 'items_per_s': True}
+
+
+def compare(args):
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = baseline[name].get(metric), current[name].get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = 'REGRESSION' if worse > args.threshold else ''
+            regressions += bool(flag)
+            if flag or args.verbose:
+                print(f'{name:45s} {metric:12s} {old:12.2f} -> {new:12.2f} '
+                      f'({change:+.1%}) {flag}')
+    for name in sorted(set(baseline) - set(current)):
+        print(f'{name:45s} missing from {args.current}')
+    print(f'{regressions} regression(s) beyond {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+def check(args):
+    failures = check_templates(args.count, args.font)
+    for failure in failures[:20]:
+        print(f'DIFFERS {failure}')
+    print(f'{len(failures)} of {args.count} labels differ' if failures
+          else f'All {args.count} labels match')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the QR render and batch hot paths')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_run = sub.add_parser('run', help='Run the benchmarks and save results as JSON')
+    p_run.add_argument('--out', default='bench_results.json', help='Where to save results')
+    p_run.add_argument('--suite', action='append', choices=SUITES,
+                       help='Only run this suite (repeatable; default: all)')
+    p_run.add_argument('--quick', action='store_true', help='Smaller inputs for a fast smoke run')
+    p_run.add_argument('--workers', type=int, default=1,
+                       help='Workers for the end-to-end batches (default: 1)')
+
+    p_cmp = sub.add_parser('compare', help='Compare two result files and flag regressions')
+    p_cmp.add_argument('baseline', help='Baseline results JSON')
+    p_cmp.add_argument('current', help='New results JSON')
+    p_cmp.add_argument('--threshold', type=float, default=0.10,
+                       help='Relative slowdown that counts as a regression (default: 0.10)')
+    p_cmp.add_argument('--verbose', action='store_true', help='Show unchanged metrics too')
+
+    p_check = sub.add_parser('check', help='Check that template-rendered labels match '
+                                           'labels drawn from scratch')
+    p_check.add_argument('--count', type=int, default=500, help='Labels compared (default: 500)')
+    p_check.add_argument('--font', action='append', default=[None],
+                         help='Also use this TrueType font (repeatable)')
+
+    args = parser.parse_args()
+    commands = {'run': run, 'compare': compare, 'check': check}
+    sys.exit(commands[args.command](args))
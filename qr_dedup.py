@@ -0,0 +1,88 @@
+import time
+from collections import deque
+
+from qr_assets import LRUCache
+
+# Rendered values kept for reuse; older payloads that repeat are rendered again
+MAX_VALUES = 2048
+
+
+class Deduplicator:
+    """
+    Render each distinct payload only once per batch.
+
+    Outputs are keyed on (style, payload), where style identifies the render
+    options (see qr_manifest.style_key). filter() passes the first job for
+    each key on to the batch engine and holds back repeats; expand() wraps
+    the engine's results and yields each held-back repeat as a result of its
+    own, carrying the original's value (the same encoded bytes) or error.
+    The last max_values values are kept, so a repeat whose original finished
+    long ago may be rendered again rather than growing memory without bound.
+    """
+
+    def __init__(self, style='', max_values=MAX_VALUES):
+        self.style = style
+        self.rendered = 0
+        self.duplicates = 0
+        self.render_seconds = 0.0
+        self._values = LRUCache(max_values)
+        self._inflight = {}  # index of a job being rendered -> its key
+        self._waiting = {}  # key -> [(index, name)] repeats of an in-flight job
+        self._ready = deque()  # repeats whose value is already known
+
+    def filter(self, jobs):
+        """
+        Pass (index, data, name) jobs through, holding back repeated payloads.
+        """
+        for index, data, name in jobs:
+            key = (self.style, data)
+            if key in self._waiting:
+                self._waiting[key].append((index, name))
+                self.duplicates += 1
+                continue
+            value = self._values.get(key)
+            if value is not None:
+                self._ready.append((index, name, None, value))
+                self.duplicates += 1
+                continue
+            self._waiting[key] = []
+            self._inflight[index] = key
+            yield index, data, name
+
+    def expand(self, results):
+        """
+        Yield the engine's (index, name, error, value) results, each followed
+        by the repeats that were waiting for it. Time spent waiting on the
+        engine is added to render_seconds.
+        """
+        results = iter(results)
+        while True:
+            start = time.perf_counter()
+            result = next(results, None)
+            self.render_seconds += time.perf_counter() - start
+            if result is None:
+                break
+            yield result
+            index, _, error, value = result
+            key = self._inflight.pop(index, None)
+            if key is not None:
+                self.rendered += 1
+                if error is None:
+                    self._values.put(key, value)
+                for repeat_index, repeat_name in self._waiting.pop(key):
+                    yield repeat_index, repeat_name, error, value
+            while self._ready:
+                yield self._ready.popleft()
+        while self._ready:
+            yield self._ready.popleft()
+
+    def saved_seconds(self):
+        """
+        Estimated rendering time saved: the mean render time of the distinct
+        payloads times the number of repeats.
+        """
+        return self.duplicates * self.render_seconds / self.rendered if self.rendered else 0.0
+
+    def summary(self):
+        return (f'{self.duplicates:,} duplicate(s) reused, '
+                f'~{self.saved_seconds():.1f} s of rendering saved')
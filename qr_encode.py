@@ -0,0 +1,202 @@
+from functools import lru_cache
+
+import qrcode
+from qrcode import util
+from qrcode.constants import ERROR_CORRECT_M
+
+import qr_profile
+from qr_assets import LRUCache
+
+try:
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+except ImportError:  # NumPy is optional; qrcode's own mask scoring is used instead
+    np = None
+
+ENCODERS = ('fit', 'sequence', 'sequence-remask')
+
+# Byte -> character class ('n'umeric, 'a'lphanumeric, 'b'yte), mirroring how
+# qrcode.util.optimal_data_chunks splits a payload into encoding modes
+_CLASS_TABLE = bytes(
+    ord('n') if b in b'0123456789' else ord('a') if b in util.ALPHA_NUM else ord('b')
+    for b in range(256)
+)
+
+
+def payload_shape(data):
+    """
+    Key identifying payloads that encode to the same bit length: the
+    per-byte character classes of the UTF-8 payload. Payloads with equal
+    shapes share a QR version (and so a data layout) at any error level.
+    """
+    return util.to_bytestring(data).translate(_CLASS_TABLE)
+
+
+@lru_cache(maxsize=None)
+def _mask_patterns(count):
+    """
+    The 8 standard mask patterns as a (8, count, count) boolean array.
+    """
+    i, j = np.indices((count, count))
+    return np.stack([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+    ])
+
+
+@lru_cache(maxsize=None)
+def _data_region(version):
+    """
+    Boolean array of the modules map_data fills (i.e. the ones masking flips)
+    for a version: everything not taken by finder, alignment, timing, format
+    or version information.
+    """
+    qr = qrcode.QRCode(version=version)
+    count = qr.modules_count = version * 4 + 17
+    qr.modules = [[None] * count for _ in range(count)]
+    qr.setup_position_probe_pattern(0, 0)
+    qr.setup_position_probe_pattern(count - 7, 0)
+    qr.setup_position_probe_pattern(0, count - 7)
+    qr.setup_position_adjust_pattern()
+    qr.setup_timing_pattern()
+    qr.setup_type_info(True, 0)
+    if version >= 7:
+        qr.setup_type_number(True)
+    return np.array([[m is None for m in row] for row in qr.modules])
+
+
+def _run_penalty(modules):
+    """
+    Rule 1 along rows: each run of 5+ same-coloured modules costs length - 2.
+    """
+    rows, count = modules.shape
+    change = np.ones((rows, count + 1), dtype=bool)
+    change[:, 1:count] = modules[:, 1:] != modules[:, :-1]
+    runs = np.diff(np.flatnonzero(change))
+    runs = runs[runs >= 5]
+    return int(runs.sum() - 2 * runs.size)
+
+
+_FINDER_LIKE = np.array([[1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0],
+                         [0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1]], dtype=bool) if np else None
+
+
+def _finder_penalty(modules):
+    """
+    Rule 3 along rows: 40 per 1:1:3:1:1 finder-like pattern with a light side.
+    """
+    if modules.shape[1] < 11:
+        return 0
+    windows = sliding_window_view(modules, 11, axis=1)[:, :, None, :]
+    return 40 * int((windows == _FINDER_LIKE).all(axis=-1).sum())
+
+
+def penalty(modules):
+    """
+    Mask penalty score of a module matrix (no border), vectorised.
+    Gives the same value as qrcode.util.lost_point.
+    """
+    modules = np.asarray(modules, dtype=bool)
+    count = modules.shape[0]
+    score = _run_penalty(modules) + _run_penalty(modules.T)
+    top_left = modules[:-1, :-1]
+    blocks = ((top_left == modules[1:, :-1]) & (top_left == modules[:-1, 1:])
+              & (top_left == modules[1:, 1:]))
+    score += 3 * int(blocks.sum())
+    score += _finder_penalty(modules) + _finder_penalty(modules.T)
+    percent = modules.sum() * 100 / (count * count)
+    score += 10 * int(abs(percent - 50) / 5)
+    return score
+
+
+def best_mask_pattern(qr):
+    """
+    Vectorised replacement for QRCode.best_mask_pattern: lays the data out
+    once, derives the other 7 masked variants by XOR over the data region
+    and returns the pattern with the lowest penalty (lowest index on ties,
+    as qrcode does). qr must already have its version set.
+    """
+    with qr_profile.stage('encode.mask'):
+        if np is None:
+            return qr.best_mask_pattern()
+        qr.makeImpl(True, 0)
+        base = np.array(qr.modules, dtype=bool)
+        patterns = _mask_patterns(qr.modules_count)
+        flips = (patterns ^ patterns[0]) & _data_region(qr.version)
+        scores = [penalty(base ^ flip) for flip in flips]
+        return scores.index(min(scores))
+
+
+class SequenceEncoder:
+    """
+    Encode many payloads of the same shape (e.g. prefix + zero-padded number
+    + suffix) without redoing the per-item version search and mask scoring.
+
+    The first payload of each shape (see payload_shape) is fitted normally
+    and its version and best mask are remembered; later payloads of that
+    shape are laid out directly on the pinned version and mask. With
+    remask=True the version stays pinned but the mask is re-chosen per item
+    (vectorised), trading some speed for the best possible mask.
+    """
+
+    def __init__(self, border=2, error_correction=ERROR_CORRECT_M, remask=False,
+                 max_shapes=256):
+        self.border = border
+        self.error_correction = error_correction
+        self.remask = remask
+        self._shapes = LRUCache(max_shapes)
+
+    def _fit(self, data):
+        qr = qrcode.QRCode(border=self.border, error_correction=self.error_correction)
+        qr.add_data(data)
+        qr.best_fit()
+        return qr.version, best_mask_pattern(qr)
+
+    def encode(self, data):
+        """
+        Return a made qrcode.QRCode for data.
+        """
+        version, mask = self._shapes.get_or_create(payload_shape(data),
+                                                   lambda: self._fit(data))
+        qr = qrcode.QRCode(version=version, border=self.border,
+                           error_correction=self.error_correction)
+        qr.add_data(data)
+        if self.remask:
+            mask = best_mask_pattern(qr)
+        qr.makeImpl(False, mask)
+        return qr
+
+
+_sequence_encoders = {}
+
+
+def make_qr(data, border=2, error_correction=ERROR_CORRECT_M, encoder='fit'):
+    """
+    Build a made qrcode.QRCode for data.
+
+    encoder='fit' is the classic per-item best fit (with vectorised mask
+    scoring when NumPy is available; output is identical to qr.make()).
+    'sequence' and 'sequence-remask' use a per-process SequenceEncoder,
+    pinning the version (and for 'sequence' also the mask) per payload shape.
+    """
+    with qr_profile.stage('encode'):
+        if encoder == 'fit':
+            qr = qrcode.QRCode(border=border, error_correction=error_correction)
+            qr.add_data(data)
+            qr.best_fit()
+            qr.makeImpl(False, best_mask_pattern(qr))
+            return qr
+        if encoder not in ENCODERS:
+            raise ValueError(f'Unknown encoder {encoder!r}, expected one of {ENCODERS}')
+        key = (border, error_correction, encoder == 'sequence-remask')
+        seq = _sequence_encoders.get(key)
+        if seq is None:
+            seq = _sequence_encoders[key] = SequenceEncoder(border, error_correction,
+                                                            remask=key[2])
+        return seq.encode(data)
@@ -0,0 +1,219 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import qr_profile
+import qr_verify
+from qr_dedup import Deduplicator
+from qr_manifest import Manifest, style_key
+from qr_sinks import WRITER_THREADS, PipelinedSink, encoded_label, open_sink, rendered_label
+
+
+def default_workers():
+    """
+    Number of worker processes used when none is requested: one per core.
+    """
+    return os.cpu_count() or 1
+
+
+def iter_chunks(jobs, chunk_size):
+    """
+    Group an iterable of jobs into lists of at most chunk_size items.
+    Consumes the input lazily, so generators are never fully materialised.
+    """
+    it = iter(jobs)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def render_chunk(render, chunk, options):
+    """
+    Render every (index, data, out_path) job in a chunk with render(data, out_path, **options).
+
+    Runs inside the worker process. Failures are collected per item instead of
+    aborting the chunk; each result is (index, out_path, error, value) where
+    error is None on success or the exception message, and value is whatever
+    render returned (e.g. encoded image data for the parent to write).
+    """
+    results = []
+    for index, data, out_path in chunk:
+        try:
+            with qr_profile.stage('render'):
+                value = render(data, out_path, **options)
+            results.append((index, out_path, None, value))
+        except Exception as e:
+            results.append((index, out_path, str(e) or type(e).__name__, None))
+    return results
+
+
+def render_chunk_profiled(render, chunk, options):
+    """
+    render_chunk with stage timing on in the worker; returns (results, timings)
+    where timings is a qr_profile snapshot covering just this chunk.
+    """
+    qr_profile.enable()
+    qr_profile.reset()
+    results = render_chunk(render, chunk, options)
+    return results, qr_profile.snapshot()
+
+
+def run_batch(jobs, render, options=None, workers=None, chunk_size=64, cancel=None):
+    """
+    Render a stream of (index, data, out_path) jobs and yield (index, out_path, error, value).
+
+    render must be a module-level function so it can be sent to worker processes.
+    Jobs are fed to a process pool in chunks of chunk_size, with at most two chunks
+    per worker in flight so memory stays bounded for arbitrarily long inputs.
+    Results are yielded in input order. cancel is an optional callable polled
+    between chunks; once it returns True no further chunks are submitted.
+    With workers <= 1 everything runs in the calling process. While qr_profile
+    is enabled here, workers time their stages too and the timings are merged
+    into this process's.
+    """
+    options = options or {}
+    workers = default_workers() if workers is None else workers
+    chunk_size = max(1, chunk_size)
+    chunks = iter_chunks(jobs, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            if cancel and cancel():
+                return
+            yield from render_chunk(render, chunk, options)
+        return
+
+    profile = qr_profile.enabled()
+
+    def collect(future):
+        if not profile:
+            return future.result()
+        results, timings = future.result()
+        qr_profile.merge(timings)
+        return results
+
+    max_pending = workers * 2
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for chunk in chunks:
+                if cancel and cancel():
+                    break
+                pending.append(pool.submit(render_chunk_profiled if profile else render_chunk,
+                                           render, chunk, options))
+                if len(pending) >= max_pending:
+                    yield from collect(pending.popleft())
+            while pending and not (cancel and cancel()):
+                yield from collect(pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def label_render(workers, writers=WRITER_THREADS, dedup=None, verify=None):
+    """
+    Render function for raster labels going to a sink. A single process
+    hands over the image and leaves the encoding to the writer threads,
+    unless repeats will reuse the result or it is decoded again to verify
+    it; then workers return encoded bytes.
+    """
+    if workers <= 1 and writers > 0 and not dedup and verify != 'reload':
+        return rendered_label
+    return encoded_label
+
+
+class BatchRun:
+    """
+    One batch from jobs to saved outputs, as the GUI and qr_batch run it.
+
+    Results go onto sheet (anything with add(), e.g. a SheetPDFWriter) or to
+    a sink of kind opened at output, encoded and written in the background
+    by writers threads. With a manifest path every outcome is recorded there
+    and, for a folder sink without force, jobs whose file is already up to
+    date are skipped. With dedup ('bytes' or 'link') each repeated value is
+    rendered once; verify ('image' or 'reload') turns on qr_verify checks.
+    """
+
+    def __init__(self, render, options, output=None, sink='dir', sheet=None, fmt='JPEG',
+                 manifest=None, force=False, dedup=None, verify=None, writers=WRITER_THREADS):
+        self.render = render
+        self.style = style_key(options)
+        # Added after the style key: checking does not change the output
+        self.options = dict(options, verify=verify) if verify else options
+        self.sheet = sheet
+        self.sink = None if sheet else open_sink(sink, output, link=dedup == 'link')
+        self.fmt = fmt
+        self.writers = writers
+        self.manifest = None
+        if manifest:
+            # Only a folder of individual files can be updated in place
+            self.manifest = Manifest(manifest, output if sink == 'dir' and not force else None)
+        self.dedup = Deduplicator(self.style) if dedup else None
+        self.failed = 0
+        self.unverified = 0
+
+    def run(self, jobs, workers=None, chunk_size=64, cancel=None, on_result=None,
+            on_skip=None):
+        """
+        Render (index, data, name) jobs on run_batch and save the results,
+        calling on_result(index, name, error) as each one is handed over and
+        on_skip(index, name) for each job the manifest finds up to date.
+        The sink and manifest are closed at the end; the sheet is left open.
+        """
+        manifest = self.manifest
+        if manifest:
+            jobs = manifest.pending(jobs, self.style, on_skip)
+        if self.dedup:
+            jobs = self.dedup.filter(jobs)
+        sink = self.sink
+        pipelined = bool(sink) and self.writers > 0
+        if pipelined:
+            # Written items are recorded from the writer threads
+            sink = PipelinedSink(sink, self.fmt, threads=self.writers, cancel=cancel,
+                                 on_written=manifest.record if manifest else None)
+        results = run_batch(jobs, self.render, self.options, workers=workers,
+                            chunk_size=chunk_size, cancel=cancel)
+        if self.dedup:
+            results = self.dedup.expand(results)
+        try:
+            for index, name, error, value in results:
+                if error:
+                    self.failed += 1
+                    self.unverified += error.startswith(qr_verify.FAILED)
+                elif self.sheet:
+                    with qr_profile.stage('write'):
+                        self.sheet.add(value)
+                else:
+                    # Pipelined, this is only the wait for a free queue slot
+                    with qr_profile.stage('queue' if pipelined else 'write'):
+                        sink.write(name, value)
+                if manifest and (error or not pipelined):
+                    manifest.record(name, value, error)
+                if on_result:
+                    on_result(index, name, error)
+        finally:
+            try:
+                if sink:
+                    sink.close()
+            finally:
+                if manifest:
+                    manifest.close()
+
+    def notes(self):
+        """
+        Closing remarks on a finished run: skipped items, duplicates reused
+        and the links written for them.
+        """
+        notes = []
+        if self.manifest and self.manifest.skipped:
+            notes.append(f'Skipped {self.manifest.skipped:,} up-to-date item(s)')
+        if self.dedup and self.dedup.duplicates:
+            notes.append(self.dedup.summary())
+            links = getattr(self.sink, 'links', None)
+            if links and any(links.values()):
+                notes.append(', '.join(f'{n:,} {kind}(s)' for kind, n in links.items())
+                             + ' written')
+        return notes
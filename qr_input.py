@@ -0,0 +1,126 @@
+import codecs
+import csv
+
+from qr_assets import LRUCache, file_key
+
+# How much of the file is inspected to guess its encoding
+SNIFF_BYTES = 64 * 1024
+
+_summaries = LRUCache(8)
+
+# codecs error handler that decodes bytes invalid in the sniffed encoding
+# as Latin-1, so a stray Latin-1 byte past the sample still reads correctly
+LATIN1_FALLBACK = 'qr-latin1-fallback'
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def _latin1_fallback(error):
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    return error.object[error.start:error.end].decode('latin-1'), error.end
+
+
+codecs.register_error(LATIN1_FALLBACK, _latin1_fallback)
+
+
+def sniff_encoding(path, sample_size=SNIFF_BYTES):
+    """
+    Guess a file's text encoding from its BOM and the first few KB.
+
+    Recognises UTF-8 and UTF-16 BOMs, BOM-less UTF-16 (by the pattern of NUL
+    bytes) and plain UTF-8. Anything else is treated as latin-1.
+    """
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    half = len(sample) // 2
+    if half:
+        even_nuls = sample[0::2].count(0)
+        odd_nuls = sample[1::2].count(0)
+        if odd_nuls > half * 0.3 and even_nuls < half * 0.05:
+            return 'utf-16-le'
+        if even_nuls > half * 0.3 and odd_nuls < half * 0.05:
+            return 'utf-16-be'
+    try:
+        # final=False tolerates a multi-byte character cut off by the sample
+        codecs.getincrementaldecoder('utf-8')().decode(
+            sample, final=len(sample) < sample_size)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def parse_column(value):
+    """
+    Convert a user-supplied column spec into what read_input_file expects:
+    None for blank, an int for a 0-based index, otherwise a header name.
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def read_input_file(path, column=None, skip_header=False, delimiter=','):
+    """
+    Lazily yield the rows of a text or CSV file as strings.
+
+    The encoding is sniffed once up front (see sniff_encoding) and the file is
+    then read incrementally, so memory use does not grow with the file size.
+    Without a column each line is yielded with its newline stripped. With a
+    column the file is parsed as CSV and only that field is yielded; column is
+    either a 0-based index or a header name (which implies skipping the header).
+    Bytes the sniffed encoding cannot decode (say, Latin-1 text that only
+    starts after the sample) are read as Latin-1 rather than replaced.
+    """
+    encoding = sniff_encoding(path)
+    with open(path, encoding=encoding, errors=LATIN1_FALLBACK, newline='') as f:
+        if column is None:
+            rows = (line.rstrip('\r\n') for line in f)
+            if skip_header:
+                next(rows, None)
+            yield from rows
+            return
+
+        reader = csv.reader(f, delimiter=delimiter)
+        if isinstance(column, str):
+            header = next(reader, None) or []
+            try:
+                column = header.index(column)
+            except ValueError:
+                raise ValueError(f'Column {column!r} not found in header') from None
+        elif skip_header:
+            next(reader, None)
+        for row in reader:
+            try:
+                yield row[column]
+            except IndexError:
+                yield ''
+
+
+def input_summary(path, column=None, skip_header=False, delimiter=','):
+    """
+    Return (first row, row count) for an input file in one streaming pass.
+    Results are cached by path, modification time and size (plus the reader
+    options), so repeated calls for an unchanged file cost nothing.
+    """
+    def scan():
+        first, count = '', 0
+        for row in read_input_file(path, column, skip_header, delimiter):
+            if not count:
+                first = row
+            count += 1
+        return first, count
+
+    key = (file_key(path), column, skip_header, delimiter)
+    return _summaries.get_or_create(key, scan)
@@ -0,0 +1,110 @@
+import os
+
+from PIL import Image, ImageDraw
+
+import qr_profile
+import qr_verify
+from qr_assets import load_font, text_size
+from qr_encode import make_qr
+from qr_render import render_qr
+from qr_template import label_template
+from qr_vector import vector_label
+
+# Format menu entries beyond the plain file formats
+SHEET_FORMAT = 'PDF sheet'
+VECTOR_PDF_FORMAT = 'PDF (vector)'
+
+
+def create_qr_image(data, size=300, qr_margin=0,
+                    font_size=14, font_path=None,
+                    text_margin_bottom=10, renderer='auto', encoder='fit',
+                    color_mode='RGB'):
+    qr = make_qr(data, border=2, encoder=encoder)
+    img_qr = render_qr(qr, size, renderer, bilevel=color_mode == '1')
+    with qr_profile.stage('text.measure'):
+        font = load_font(font_path or 'arial.ttf', font_size)
+        text_w, text_h = text_size(data, font_path or 'arial.ttf', font_size)
+    with qr_profile.stage('compose'):
+        # calculate canvas size
+        canvas_w = size + qr_margin * 2
+        canvas_h = size + qr_margin * 2 + text_h + text_margin_bottom
+        canvas = Image.new(color_mode, (canvas_w, canvas_h), 'white')
+        canvas.paste(img_qr, (qr_margin, qr_margin))
+        draw = ImageDraw.Draw(canvas)
+        text_x = (canvas_w - text_w) // 2
+        text_y = size + qr_margin * 2
+        draw.text((text_x, text_y), data, font=font, fill='black')
+    return canvas
+
+
+def file_extension(fmt):
+    """
+    File extension for a format as shown in the Format menu.
+    """
+    fmt = fmt.upper()
+    if fmt in ('JPG', 'JPEG'):
+        return 'jpg'
+    if fmt in (SHEET_FORMAT.upper(), VECTOR_PDF_FORMAT.upper()):
+        return 'pdf'
+    return fmt.lower()
+
+
+def create_qr_vector(data, out_path=None, fmt='SVG', size=300, qr_margin=0,
+                     font_size=14, font_path=None,
+                     text_margin_bottom=10, encoder='fit'):
+    """
+    The create_qr_image layout as SVG or vector PDF bytes (out_path is
+    unused; it keeps the batch engine's render signature).
+    """
+    return vector_label(data, fmt=fmt, size=size, qr_margin=qr_margin,
+                        font_size=font_size, font_path=font_path or 'arial.ttf',
+                        text_margin_bottom=text_margin_bottom, border=2, encoder=encoder)
+
+
+def make_qr_with_label(data, out_path, fmt='JPG', size=300,
+                       qr_margin=0, font_size=14, font_path=None,
+                       text_margin_bottom=10, renderer='auto', encoder='fit',
+                       vector=False, color_mode='RGB'):
+    out_path = os.path.splitext(out_path)[0] + f'.{file_extension(fmt)}'
+    # SVG is always vector; vector=True also writes PDFs as paths and text
+    if vector or fmt.upper() in ('SVG', VECTOR_PDF_FORMAT.upper()):
+        with open(out_path, 'wb') as f:
+            f.write(create_qr_vector(data, out_path, 'SVG' if fmt.upper() == 'SVG' else 'PDF',
+                                     size, qr_margin, font_size, font_path,
+                                     text_margin_bottom, encoder))
+        return
+    img = create_qr_image(data, size, qr_margin,
+                           font_size, font_path,
+                           text_margin_bottom, renderer, encoder, color_mode)
+    save_fmt = 'JPEG' if fmt.upper() in ('JPG', 'JPEG') else fmt.upper()
+    with qr_profile.stage('save'):
+        img.save(out_path, save_fmt)
+
+
+def compose_image(data, size=300, qr_margin=0, font_size=14,
+                  text_margin_bottom=10, bg_file='', bg_offset=(0, 0),
+                  renderer='auto', encoder='fit', color_mode='RGB', static_text=('', ''),
+                  verify=False):
+    """
+    Render one labelled QR code and composite it onto an optional background image.
+    The label stays in color_mode; composited onto a background it takes the
+    background's (RGB) mode.
+
+    Gives the same pixels as create_qr_image followed by pasting onto the
+    background, but draws the canvas, background and any constant
+    static_text (prefix, suffix) of the label once per style (see
+    qr_template.LabelTemplate). With verify, the code's module centres are
+    checked against its matrix (see qr_verify.expect).
+    """
+    qr = make_qr(data, border=2, encoder=encoder)
+    img_qr = render_qr(qr, size, renderer, bilevel=color_mode == '1')
+    template = label_template(size=size, qr_margin=qr_margin, font_size=font_size,
+                              font_path='arial.ttf', text_margin_bottom=text_margin_bottom,
+                              bg_file=bg_file, bg_offset=tuple(bg_offset),
+                              color_mode=color_mode)
+    img = template.render(img_qr, data, *static_text)
+    if verify:
+        x, y = template.origin
+        qr_verify.expect(img, qr.get_matrix(), size, (x + qr_margin, y + qr_margin),
+                         border=qr.border)
+    return img
@@ -0,0 +1,141 @@
+import csv
+import hashlib
+import json
+import os
+import threading
+
+from qr_assets import file_key
+
+FIELDS = ('name', 'index', 'data', 'style', 'sha256', 'bytes', 'status', 'error')
+
+# Rows are flushed to disk this often, bounding what a crash can lose
+FLUSH_EVERY = 500
+
+# Options naming files whose contents shape the output
+FILE_OPTIONS = ('bg_file', 'font_path')
+
+
+def style_key(options):
+    """
+    Short stable hash of the render options (functions by qualified name),
+    so a changed size, font, format, etc. marks every output as stale.
+    Background and font files count by file_key(), so editing one in place
+    does too.
+    """
+    def default(value):
+        if callable(value):
+            return f'{value.__module__}.{value.__qualname__}'
+        return str(value)
+
+    keyed = dict(options)
+    for option in FILE_OPTIONS:
+        if options.get(option):
+            keyed[option] = file_key(options[option])
+    blob = json.dumps(keyed, sort_keys=True, default=default)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:16]
+
+
+class Manifest:
+    """
+    CSV record of a batch: one row per output with its data, style hash,
+    content hash, size and status (ok/error, with the error message).
+
+    Rows are appended as items finish, so a crashed run leaves a usable
+    manifest behind; when a name appears more than once the last row wins,
+    and close() compacts the file to one row per name. Jobs pass through
+    pending(), which remembers their data until record() is called for them
+    and, with out_dir set, skips jobs whose file is already up to date.
+    """
+
+    def __init__(self, path, out_dir=None):
+        self.path = path
+        self.out_dir = out_dir
+        self.entries = {}
+        self.skipped = 0
+        self.failed = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    self.entries[row['name']] = row
+        fresh = not os.path.isfile(path) or not self.entries
+        self._file = open(path, 'w' if fresh else 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, FIELDS)
+        if fresh:
+            self._writer.writeheader()
+        self._unflushed = 0
+
+    def is_current(self, name, data, style):
+        """
+        True if name was written successfully for this data and style and
+        the file on disk still has the recorded size and SHA-256.
+        """
+        row = self.entries.get(name)
+        if not row or row['status'] != 'ok' or row['data'] != data or row['style'] != style:
+            return False
+        if self.out_dir is None:
+            return False
+        path = os.path.join(self.out_dir, name)
+        try:
+            if os.path.getsize(path) != int(row['bytes']):
+                return False
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest() == row['sha256']
+        except (OSError, ValueError):
+            return False
+
+    def pending(self, jobs, style, on_skip=None):
+        """
+        Filter (index, data, name) jobs down to those that need rendering,
+        calling on_skip(index, name) for each one left out.
+        """
+        for index, data, name in jobs:
+            if self.is_current(name, data, style):
+                self.skipped += 1
+                if on_skip:
+                    on_skip(index, name)
+            else:
+                with self._lock:
+                    self._inflight.setdefault(name, []).append((index, data, style))
+                yield index, data, name
+
+    def record(self, name, payload=None, error=None):
+        """
+        Append the outcome of a job that came through pending();
+        payload is the bytes written, if any. Safe to call from writer threads.
+        """
+        with self._lock:
+            self._record(name, payload, error)
+
+    def _record(self, name, payload, error):
+        queued = self._inflight[name]
+        index, data, style = queued.pop(0)
+        if not queued:
+            del self._inflight[name]
+        row = {'name': name, 'index': index, 'data': data, 'style': style,
+               'sha256': '', 'bytes': '', 'status': 'ok', 'error': ''}
+        if error is not None:
+            row['status'], row['error'] = 'error', error
+            self.failed += 1
+        elif payload is not None:
+            row['sha256'] = hashlib.sha256(payload).hexdigest()
+            row['bytes'] = len(payload)
+        self.entries[name] = row
+        self._writer.writerow(row)
+        self._unflushed += 1
+        if self._unflushed >= FLUSH_EVERY:
+            self._file.flush()
+            self._unflushed = 0
+
+    def close(self):
+        """
+        Rewrite the manifest with one (latest) row per output name.
+        """
+        self._file.close()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(self.entries.values())
+        os.replace(tmp, self.path)
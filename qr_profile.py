@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+# Stage timings are only collected once enable() has been called; until then
+# stage() hands out this shared no-op context manager
+_NULL = nullcontext()
+_enabled = False
+_lock = threading.Lock()
+# name -> [count, total s, min s, max s, {log2 bucket: count}]
+_stats = {}
+
+
+def enable(on=True):
+    """
+    Turn stage timing on or off for this process.
+    """
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def _bucket(seconds):
+    # Bucket b holds durations up to 2**b microseconds
+    return int(seconds * 1e6).bit_length()
+
+
+def record(name, seconds):
+    """
+    Add one timing of seconds to stage name.
+    """
+    bucket = _bucket(seconds)
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            _stats[name] = [1, seconds, seconds, seconds, {bucket: 1}]
+            return
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = min(stat[2], seconds)
+        stat[3] = max(stat[3], seconds)
+        stat[4][bucket] = stat[4].get(bucket, 0) + 1
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+
+
+def stage(name):
+    """
+    Context manager timing the enclosed block as stage name. Dotted names
+    mark nesting: 'encode.mask' is part of the time recorded for 'encode'.
+    Costs one function call while profiling is disabled.
+    """
+    return _Stage(name) if _enabled else _NULL
+
+
+def snapshot():
+    """
+    Picklable copy of this process's timings, for merge() in another process.
+    """
+    with _lock:
+        return {name: [c, t, lo, hi, dict(h)] for name, (c, t, lo, hi, h) in _stats.items()}
+
+
+def merge(snap):
+    """
+    Add the timings from another process's snapshot() to this one.
+    """
+    with _lock:
+        for name, (count, total, lo, hi, hist) in snap.items():
+            stat = _stats.get(name)
+            if stat is None:
+                _stats[name] = [count, total, lo, hi, dict(hist)]
+                continue
+            stat[0] += count
+            stat[1] += total
+            stat[2] = min(stat[2], lo)
+            stat[3] = max(stat[3], hi)
+            for bucket, n in hist.items():
+                stat[4][bucket] = stat[4].get(bucket, 0) + n
+
+
+def summary():
+    """
+    Per-stage totals and histograms as plain data, slowest stage first.
+    Histogram entries are [upper bound in ms, count].
+    """
+    stages = {}
+    for name, (count, total, lo, hi, hist) in sorted(
+            snapshot().items(), key=lambda item: -item[1][1]):
+        stages[name] = {
+            'count': count,
+            'total_s': total,
+            'mean_ms': total / count * 1e3,
+            'min_ms': lo * 1e3,
+            'max_ms': hi * 1e3,
+            'histogram': [[2 ** b / 1e3, n] for b, n in sorted(hist.items())],
+        }
+    return stages
+
+
+def write_report(path, wall_seconds=None, **meta):
+    """
+    Save summary() as JSON along with the wall-clock time and any extra metadata.
+    """
+    report = {'meta': dict(meta, wall_s=wall_seconds), 'stages': summary()}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+
+def format_summary():
+    """
+    Human-readable table of the per-stage totals.
+    """
+    lines = [f'{"stage":24s} {"count":>9s} {"total s":>10s} {"mean ms":>9s} {"max ms":>9s}']
+    for name, s in summary().items():
+        lines.append(f'{name:24s} {s["count"]:9,d} {s["total_s"]:10.3f} '
+                     f'{s["mean_ms"]:9.3f} {s["max_ms"]:9.3f}')
+    return '\n'.join(lines)
@@ -0,0 +1,121 @@
+import queue
+import time
+
+
+def format_duration(seconds):
+    """
+    Format a number of seconds as H:MM:SS.
+    """
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class ProgressChannel:
+    """
+    Progress reporting from one batch thread to a UI that polls on a timer.
+
+    The batch thread calls item_done() per item, which only bumps counters;
+    messages (errors, a summary every summary_interval seconds and the final
+    line) go through a queue the UI drains at its own pace. This keeps the
+    UI's event queue free of per-item callbacks on long runs.
+    """
+
+    def __init__(self, total=0, summary_interval=5.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.finished = False
+        self.summary_interval = summary_interval
+        self._messages = queue.Queue()
+        self._start = time.monotonic()
+        self._next_summary = self._start + summary_interval
+
+    def item_done(self, error=None, label=None):
+        """
+        Record one finished item; error is the failure message, if any.
+        """
+        self.done += 1
+        if error is not None:
+            self.failed += 1
+            self._messages.put(f'✗ {label}: {error}')
+        now = time.monotonic()
+        if now >= self._next_summary:
+            self._next_summary = now + self.summary_interval
+            self._messages.put(self.summary())
+
+    def item_skipped(self):
+        """
+        Record one item that needed no work (e.g. already up to date). It
+        counts as done but not towards the rate, so the ETA stays honest.
+        """
+        self.done += 1
+        self.skipped += 1
+
+    def message(self, msg):
+        self._messages.put(msg)
+
+    def finish(self, msg=None):
+        """
+        Mark the batch as over, queueing a final summary (if anything was
+        processed) and an optional message.
+        """
+        if self.done:
+            self._messages.put(self.summary())
+        if msg:
+            self._messages.put(msg)
+        self.finished = True
+
+    def elapsed(self):
+        return time.monotonic() - self._start
+
+    def rate(self):
+        """
+        Items per second since the batch started, skipped items left out.
+        """
+        elapsed = self.elapsed()
+        return (self.done - self.skipped) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """
+        Estimated seconds remaining, or None when unknown.
+        """
+        rate = self.rate()
+        if not self.total or not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def summary(self):
+        total = f'/{self.total:,}' if self.total else ''
+        skipped = f' ({self.skipped:,} skipped)' if self.skipped else ''
+        return (f'{self.done:,}{total} done{skipped}, {self.failed:,} failed, '
+                f'{self.rate():,.0f} items/s, {format_duration(self.elapsed())} elapsed')
+
+    def status(self):
+        """
+        One-line status for a progress bar label: count, throughput and ETA.
+        """
+        parts = [f'{self.done:,}' + (f' / {self.total:,}' if self.total else ''),
+                 f'{self.rate():,.0f} items/s']
+        eta = self.eta()
+        if eta is not None and not self.finished:
+            parts.append(f'ETA {format_duration(eta)}')
+        return '  ·  '.join(parts)
+
+    def drain(self, limit=200):
+        """
+        Return up to limit queued messages without blocking.
+        """
+        messages = []
+        while len(messages) < limit:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                break
+        return messages
+
+    def idle(self):
+        """
+        True once the batch has finished and every message has been drained.
+        """
+        return self.finished and self._messages.empty()
@@ -0,0 +1,73 @@
+from PIL import Image
+
+import qr_profile
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; callers fall back to the PIL path
+    np = None
+
+RENDERERS = ('auto', 'numpy', 'pil')
+
+# Canvas modes for labels: full colour, greyscale, or 1 bit per pixel
+COLOR_MODES = ('RGB', 'L', '1')
+
+
+def resolve_renderer(renderer='auto'):
+    """
+    Map a renderer name to the backend that will actually be used:
+    'auto' picks 'numpy' when NumPy is installed and 'pil' otherwise.
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f'Unknown renderer {renderer!r}, expected one of {RENDERERS}')
+    if renderer == 'auto':
+        return 'pil' if np is None else 'numpy'
+    if renderer == 'numpy' and np is None:
+        raise RuntimeError('The numpy renderer requires NumPy to be installed')
+    return renderer
+
+
+def module_repeats(modules, size):
+    """
+    How many output pixels each of `modules` modules spans along one axis
+    when scaled to `size` pixels: size // modules each, with the remainder
+    spread exactly as a NEAREST resize would place it (output pixel x samples
+    module floor((x + 0.5) * modules / size)).
+    """
+    idx = ((2 * np.arange(size) + 1) * modules) // (2 * size)
+    return np.bincount(idx, minlength=modules)
+
+
+def render_matrix(matrix, size, bilevel=False):
+    """
+    Rasterise a QR module matrix (rows of booleans, True = dark, border
+    included) straight to a size x size greyscale image, or a mode '1'
+    image with bilevel=True.
+
+    Pixel-identical to make_image() followed by a NEAREST resize, without
+    the intermediate full-size images. The returned image wraps the NumPy
+    buffer directly (Image.frombuffer) rather than copying it.
+    """
+    dark = np.asarray(matrix, dtype=bool)
+    repeats = module_repeats(dark.shape[0], size)
+    if bilevel:
+        # Mode '1' rows are packed 8 pixels to a byte, set bits are white
+        light = np.repeat(np.repeat(~dark, repeats, axis=0), repeats, axis=1)
+        return Image.frombuffer('1', (size, size), np.packbits(light, axis=1), 'raw', '1', 0, 1)
+    modules = np.where(dark, np.uint8(0), np.uint8(255))
+    pixels = np.repeat(np.repeat(modules, repeats, axis=0), repeats, axis=1)
+    return Image.frombuffer('L', (size, size), pixels, 'raw', 'L', 0, 1)
+
+
+def render_qr(qr, size, renderer='auto', bilevel=False):
+    """
+    Render a made qrcode.QRCode as a size x size black-on-white image.
+    The numpy backend returns mode 'L', the pil backend mode 'RGB'; both
+    paste identically onto any canvas. With bilevel=True both return mode '1'.
+    """
+    with qr_profile.stage('rasterize'):
+        if resolve_renderer(renderer) == 'numpy':
+            return render_matrix(qr.get_matrix(), size, bilevel)
+        img = qr.make_image(fill_color='black', back_color='white')
+        img = img.convert('1' if bilevel else 'RGB')
+        return img.resize((size, size), Image.NEAREST)
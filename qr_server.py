@@ -0,0 +1,486 @@
+import http.client
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from qr_assets import LRUCache, cache_stats
+from qr_encode import ENCODERS
+from qr_label import compose_image, create_qr_vector
+from qr_render import COLOR_MODES, RENDERERS
+from qr_sinks import image_bytes
+
+DEFAULT_PORT = 8765
+# Responses kept for repeated requests, and the largest one worth keeping
+CACHE_SIZE = 1024
+CACHE_ITEM_MAX = 256 * 1024
+# Request limits
+MAX_BODY = 8 * 1024 * 1024
+MAX_BATCH = 10_000
+
+CONTENT_TYPES = {'PNG': 'image/png', 'JPG': 'image/jpeg', 'JPEG': 'image/jpeg',
+                 'PDF': 'application/pdf', 'SVG': 'image/svg+xml'}
+
+# Integer style parameters clients may set -> allowed range
+STYLE_LIMITS = {
+    'size': (50, 4000),
+    'qr_margin': (0, 1000),
+    'font_size': (4, 400),
+    'text_margin_bottom': (0, 1000),
+}
+
+DEFAULT_STYLE = {'size': 300, 'qr_margin': 0, 'font_size': 14, 'text_margin_bottom': 10,
+                 'fmt': 'PNG', 'vector': False, 'encoder': 'fit', 'renderer': 'auto',
+                 'color_mode': 'RGB'}
+
+# Unix domain sockets are missing on Windows; only TCP is served there
+UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def parse_style(params):
+    """
+    Validate the style parameters in a query string or JSON body and return
+    a complete style dict (DEFAULT_STYLE filled in). Raises ValueError.
+    """
+    style = dict(DEFAULT_STYLE)
+    for key, (lo, hi) in STYLE_LIMITS.items():
+        if key not in params:
+            continue
+        try:
+            value = int(params[key])
+        except (TypeError, ValueError):
+            raise ValueError(f'{key} must be an integer') from None
+        if not lo <= value <= hi:
+            raise ValueError(f'{key} must be between {lo} and {hi}')
+        style[key] = value
+    style['fmt'] = str(params.get('fmt', style['fmt'])).upper()
+    if style['fmt'] not in CONTENT_TYPES:
+        raise ValueError(f'fmt must be one of {", ".join(CONTENT_TYPES)}')
+    style['vector'] = _flag(params.get('vector', False))
+    for key, choices in (('encoder', ENCODERS), ('renderer', RENDERERS),
+                         ('color_mode', COLOR_MODES)):
+        style[key] = params.get(key, style[key])
+        if style[key] not in choices:
+            raise ValueError(f'{key} must be one of {", ".join(choices)}')
+    return style
+
+
+def extension(style):
+    return 'jpg' if style['fmt'] in ('JPG', 'JPEG') else style['fmt'].lower()
+
+
+class RenderService:
+    """
+    Renders labels the way the GUI does (compose_image / create_qr_vector)
+    for a long-running process, so fonts, backgrounds and encoder state stay
+    loaded between requests. Finished responses are cached by payload and
+    style in a bounded LRU cache. The background image, if any, is fixed by
+    the server; clients cannot name files.
+    """
+
+    def __init__(self, bg_file='', bg_offset=(0, 0), cache_size=CACHE_SIZE):
+        self.bg_file = bg_file
+        self.bg_offset = bg_offset
+        self.cache = LRUCache(cache_size)
+        self.requests = 0
+        self.rendered = 0
+        self.started = time.monotonic()
+
+    def warm(self):
+        """
+        Load fonts, the background and the render paths before the first request.
+        """
+        for fmt in ('PNG', 'SVG'):
+            self._render('WARM-UP', dict(DEFAULT_STYLE, fmt=fmt))
+        self.rendered = 0
+
+    def _render(self, data, style):
+        options = {key: style[key] for key in STYLE_LIMITS}
+        self.rendered += 1
+        if style['fmt'] == 'SVG' or (style['fmt'] == 'PDF' and style['vector']):
+            return create_qr_vector(data, fmt=style['fmt'], encoder=style['encoder'], **options)
+        img = compose_image(data, bg_file=self.bg_file, bg_offset=self.bg_offset,
+                            renderer=style['renderer'], encoder=style['encoder'],
+                            color_mode=style['color_mode'], **options)
+        return image_bytes(img, style['fmt'])
+
+    def render(self, data, style):
+        """
+        Encoded label bytes for data in a style from parse_style().
+        """
+        if not isinstance(data, str) or not data:
+            raise ValueError('data must be a non-empty string')
+        key = (data, tuple(sorted(style.items())))
+        body = self.cache.get(key)
+        if body is None:
+            body = self._render(data, style)
+            if len(body) <= CACHE_ITEM_MAX:
+                self.cache.put(key, body)
+        return body
+
+    def render_batch(self, items, style):
+        """
+        A stored ZIP of every item, plus errors.json listing any failures.
+        items are strings or {"data": ..., "name": ...} objects.
+        """
+        buf = io.BytesIO()
+        errors = []
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+            for i, item in enumerate(items, start=1):
+                if isinstance(item, dict):
+                    data, name = item.get('data'), item.get('name')
+                else:
+                    data, name = item, None
+                name = os.path.basename(str(name)) if name else f'qr_{i}.{extension(style)}'
+                try:
+                    zf.writestr(name, self.render(data, style))
+                except Exception as e:
+                    errors.append({'index': i, 'name': name, 'error': str(e) or type(e).__name__})
+            if errors:
+                zf.writestr('errors.json', json.dumps(errors, indent=2))
+        return buf.getvalue()
+
+    def stats(self):
+        return {'uptime_s': round(time.monotonic() - self.started, 1),
+                'requests': self.requests,
+                'rendered': self.rendered,
+                'response_cache': self.cache.stats(),
+                'assets': cache_stats()}
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """
+    GET  /qr?data=...&size=...&fmt=...  one label
+    POST /qr     {"data": ..., style...}  one label
+    POST /batch  {"items": [...], style...}  a ZIP of labels
+    GET  /health  counters and cache statistics as JSON
+    """
+
+    server_version = 'QRMagic'
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Headers and body are separate writes; on TCP, Nagle's algorithm would
+        # hold the body back until the client's delayed ACK
+        self.disable_nagle_algorithm = self.request.family != getattr(socket, 'AF_UNIX', None)
+        super().setup()
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, obj):
+        self._send(status, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def _read_json(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True  # where the body ends is unknown
+            raise ValueError('Content-Length required') from None
+        if length < 0:
+            self.close_connection = True
+            raise ValueError('Invalid Content-Length')
+        if length > MAX_BODY:
+            raise OverflowError(f'Request body over {MAX_BODY} bytes')
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f'Invalid JSON: {e}') from None
+        if not isinstance(body, dict):
+            raise ValueError('Expected a JSON object')
+        return body
+
+    def _skip_body(self):
+        """
+        Read and drop the body of a request that is not served, so the next
+        request on the connection is read from its start. Bodies of unknown
+        or excessive length close the connection instead.
+        """
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+        except ValueError:
+            length = -1
+        if 0 <= length <= MAX_BODY:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def _handle(self, route, params):
+        service = self.server.service
+        service.requests += 1
+        try:
+            if route == 'qr':
+                style = parse_style(params)
+                body = service.render(params.get('data'), style)
+                content_type = CONTENT_TYPES[style['fmt']]
+            else:
+                items = params.get('items')
+                if not isinstance(items, list) or not items:
+                    raise ValueError('items must be a non-empty list')
+                if len(items) > MAX_BATCH:
+                    raise OverflowError(f'At most {MAX_BATCH} items per batch')
+                body = service.render_batch(items, parse_style(params))
+                content_type = 'application/zip'
+        except OverflowError as e:
+            self._json(413, {'error': str(e)})
+            return
+        except Exception as e:
+            self._json(400, {'error': str(e) or type(e).__name__})
+            return
+        # Outside the try: a failed write must not be answered with a second response
+        self._send(200, body, content_type)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/health':
+            self._json(200, self.server.service.stats())
+        elif url.path == '/qr':
+            self._handle('qr', {k: v[-1] for k, v in parse_qs(url.query).items()})
+        else:
+            self._json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        route = urlsplit(self.path).path.strip('/')
+        if route not in ('qr', 'batch'):
+            self._skip_body()
+            self._json(404, {'error': 'Not found'})
+            return
+        try:
+            params = self._read_json()
+        except OverflowError as e:
+            self.close_connection = True
+            self._json(413, {'error': str(e)})
+            return
+        except ValueError as e:
+            self._json(400, {'error': str(e)})
+            return
+        self._handle(route, params)
+
+
+if UNIX_SOCKETS:
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            # A socket file left by an earlier run would make bind() fail
+            if os.path.exists(self.server_address):
+                os.unlink(self.server_address)
+            super().server_bind()
+
+
+def make_server(service, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """
+    An HTTP server for service on host:port, or on a Unix socket when socket_path is given.
+    """
+    if socket_path:
+        if not UNIX_SOCKETS:
+            raise ValueError('Unix sockets are not supported on this platform')
+        server = UnixHTTPServer(socket_path, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+        server.daemon_threads = True
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+if UNIX_SOCKETS:
+    class UnixHTTPConnection(http.client.HTTPConnection):
+        """
+        http.client connection over a Unix socket.
+        """
+
+        def __init__(self, socket_path, timeout=30):
+            super().__init__('localhost', timeout=timeout)
+            self.socket_path = socket_path
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socket_path)
+
+
+def request(conn, method, path, body=None):
+    """
+    Send one request on a keep-alive connection; return (status, content type, body).
+    """
+    headers = {}
+    if body is not None:
+        body = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    conn.request(method, path, body=body, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, resp.getheader('Content-Type'), resp.read()
+
+
+def check(conn, count=50):
+    """
+    Exercise a running server over conn: health, single labels in each
+    format, cache reuse, a batch and error handling. Returns the failures.
+    """
+    from PIL import Image
+
+    failures = []
+
+    def expect(cond, what):
+        print(f'{"ok  " if cond else "FAIL"} {what}')
+        if not cond:
+            failures.append(what)
+
+    status, ctype, body = request(conn, 'GET', '/health')
+    expect(status == 200 and 'response_cache' in json.loads(body), 'GET /health')
+
+    status, ctype, body = request(conn, 'GET', '/qr?data=' + quote('HELLO 123'))
+    ok = status == 200 and ctype == 'image/png'
+    if ok:
+        img = Image.open(io.BytesIO(body))
+        ok = img.format == 'PNG' and img.width == DEFAULT_STYLE['size']
+    expect(ok, 'GET /qr returns a PNG label')
+
+    for fmt, magic in (('JPG', b'\xff\xd8'), ('PDF', b'%PDF'), ('SVG', b'<svg')):
+        status, _, body = request(conn, 'POST', '/qr', {'data': 'HELLO 123', 'fmt': fmt})
+        expect(status == 200 and body.startswith(magic), f'POST /qr fmt={fmt}')
+
+    timings = {}
+    for label in ('cold', 'cached'):
+        start = time.perf_counter()
+        for i in range(count):
+            request(conn, 'GET', f'/qr?data=ITEM-{i:06d}&size=400')
+        timings[label] = (time.perf_counter() - start) / count * 1e3
+    print(f'     {count} labels: {timings["cold"]:.2f} ms/request rendered, '
+          f'{timings["cached"]:.2f} ms/request cached')
+    stats = json.loads(request(conn, 'GET', '/health')[2])
+    expect(stats['response_cache']['hits'] >= count, 'repeated requests are served from the cache')
+
+    items = [f'SKU-{i}' for i in range(20)] + [{'data': 'named', 'name': '../custom.png'}, '']
+    status, ctype, body = request(conn, 'POST', '/batch', {'items': items, 'fmt': 'PNG'})
+    ok = status == 200 and ctype == 'application/zip'
+    if ok:
+        names = zipfile.ZipFile(io.BytesIO(body)).namelist()
+        ok = len(names) == 22 and 'custom.png' in names and 'errors.json' in names
+    expect(ok, 'POST /batch returns a ZIP with every label and errors.json')
+
+    status, _, body = request(conn, 'GET', '/qr?data=x&size=nope')
+    expect(status == 400 and b'size' in body, 'invalid style is rejected with 400')
+    status, _, _ = request(conn, 'GET', '/nowhere')
+    expect(status == 404, 'unknown path gives 404')
+    conn.putrequest('POST', '/qr')
+    conn.putheader('Content-Length', '-1')
+    conn.endheaders()
+    with conn.getresponse() as response:
+        response.read()
+    expect(response.status == 400, 'negative Content-Length is rejected with 400')
+    status, _, _ = request(conn, 'POST', '/nowhere', {'data': 'x'})
+    expect(status == 404 and request(conn, 'GET', '/health')[0] == 200,
+           'POST to an unknown path gives 404 and leaves the connection usable')
+    return failures
+
+
+def serve(args):
+    service = RenderService(args.background or '', args.bg_offset, args.cache_size)
+    service.warm()
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    where = args.socket or 'http://{}:{}'.format(*server.server_address[:2])
+    print(f'QR render service listening on {where} (Ctrl+C to stop)')
+    # Service managers stop us with SIGTERM; exit through the cleanup below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+def run_check(args):
+    server = None
+    if args.socket:
+        conn = UnixHTTPConnection(args.socket)
+    elif args.url:
+        url = urlsplit(args.url)
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    else:
+        # No server given: start one on a free loopback port in this process
+        service = RenderService()
+        service.warm()
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        conn = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+    try:
+        failures = check(conn, args.count)
+    finally:
+        conn.close()
+        if server:
+            server.shutdown()
+            server.server_close()
+    print(f'{len(failures)} check(s) failed' if failures else 'All checks passed')
+    return 1 if failures else 0
+
+
+def parse_offset(value):
+    try:
+        x, y = (int(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError(f'Invalid offset {value!r}; expected X,Y') from None
+    return x, y
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve QR labels over local HTTP')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_serve = sub.add_parser('serve', help='Run the render service')
+    p_serve.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    p_serve.add_argument('--port', type=int, default=DEFAULT_PORT,
+                         help=f'TCP port (default: {DEFAULT_PORT})')
+    p_serve.add_argument('--socket', metavar='PATH', help='Listen on this Unix socket instead')
+    p_serve.add_argument('--background', metavar='IMAGE', help='Background image for raster labels')
+    p_serve.add_argument('--bg-offset', type=parse_offset, default=(0, 0), metavar='X,Y',
+                         help='Where labels go on the background (default: 0,0)')
+    p_serve.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                         help=f'Responses kept for repeated requests (default: {CACHE_SIZE})')
+    p_serve.add_argument('--verbose', action='store_true', help='Log every request')
+
+    p_check = sub.add_parser('check', help='Validate a service with a loopback test client')
+    p_check.add_argument('--url', help='Server to test, e.g. http://127.0.0.1:8765 '
+                                       '(default: start one in-process)')
+    p_check.add_argument('--socket', metavar='PATH', help='Test a server on this Unix socket')
+    p_check.add_argument('--count', type=int, default=50, help='Labels timed per pass (default: 50)')
+
+    args = parser.parse_args()
+    if args.socket and not UNIX_SOCKETS:
+        parser.error('--socket needs Unix domain sockets, which this platform does not have')
+    sys.exit(serve(args) if args.command == 'serve' else run_check(args))
@@ -0,0 +1,59 @@
+import zlib
+
+# How output files are spread over subfolders: all in one folder, in 256
+# folders picked by a hash of the file name, or in folders of consecutive items
+SUBDIR_LAYOUTS = ('none', 'hash', 'range')
+
+# Items per folder with the range layout
+RANGE_SIZE = 1000
+
+
+def parse_shard(value):
+    """
+    Parse an i/N shard spec such as '2/4' into (i, n), with 1 <= i <= n.
+    """
+    try:
+        shard, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard {value!r}; expected i/N, e.g. 2/4') from None
+    if count < 1 or not 1 <= shard <= count:
+        raise ValueError(f'Invalid shard {value!r}; i must be between 1 and N')
+    return shard, count
+
+
+def select_shard(jobs, shard, count):
+    """
+    Keep the (index, data, name) jobs that belong to shard i of n.
+
+    Jobs are dealt out round-robin by their index, so the n shards of one
+    input never overlap, together cover it, and name every file exactly as
+    an unsharded run would.
+    """
+    want = shard - 1
+    for job in jobs:
+        if job[0] % count == want:
+            yield job
+
+
+def subdir(name, index, layout='none', range_size=RANGE_SIZE):
+    """
+    Folder (relative, '' for none) that the output name with this job index goes in.
+    """
+    if layout == 'hash':
+        return f'{zlib.crc32(name.encode("utf-8")) & 0xff:02x}'
+    if layout == 'range':
+        start = index // range_size * range_size
+        return f'{start:06d}-{start + range_size - 1:06d}'
+    return ''
+
+
+def place_jobs(jobs, layout='none', range_size=RANGE_SIZE):
+    """
+    Prefix the names of (index, data, name) jobs with their subdir().
+    Names use '/' separators, which every sink accepts.
+    """
+    if layout == 'none':
+        yield from jobs
+        return
+    for index, data, name in jobs:
+        yield index, data, f'{subdir(name, index, layout, range_size)}/{name}'
@@ -0,0 +1,269 @@
+import os
+import zlib
+
+import qr_profile
+
+# PDF points per millimetre
+MM = 72 / 25.4
+
+# Named page sizes in millimetres (width, height), portrait
+PAGE_SIZES = {
+    'A3': (297.0, 420.0),
+    'A4': (210.0, 297.0),
+    'A5': (148.0, 210.0),
+    'LETTER': (215.9, 279.4),
+    'LEGAL': (215.9, 355.6),
+}
+
+
+def parse_page_size(value):
+    """
+    Parse a page size given as a name from PAGE_SIZES (case-insensitive) or
+    as WIDTHxHEIGHT in millimetres, e.g. '100x150'. Returns (width, height) in mm.
+    """
+    name = value.strip().upper()
+    if name in PAGE_SIZES:
+        return PAGE_SIZES[name]
+    try:
+        w, h = (float(v) for v in name.split('X'))
+    except ValueError:
+        raise ValueError(f'Invalid page size {value!r}; use one of '
+                         f'{", ".join(PAGE_SIZES)} or WIDTHxHEIGHT in mm') from None
+    if w <= 0 or h <= 0:
+        raise ValueError(f'Invalid page size {value!r}')
+    return w, h
+
+
+def parse_grid(value):
+    """
+    Parse a ROWSxCOLS grid spec such as '8x3' into (rows, cols).
+    """
+    try:
+        rows, cols = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f'Invalid grid {value!r}; expected ROWSxCOLS, e.g. 8x3') from None
+    if rows < 1 or cols < 1:
+        raise ValueError(f'Invalid grid {value!r}')
+    return rows, cols
+
+
+class SheetLayout:
+    """
+    Geometry of a multi-up label sheet. All lengths are in millimetres.
+
+    The trimmed page is page_size; bleed extends the printed (media) area
+    beyond it on every side. Labels sit in a rows x cols grid inside the page
+    margin, separated by gutter, and are filled row by row from the top left.
+    """
+
+    def __init__(self, page_size='A4', rows=8, cols=3, gutter=2.0, bleed=0.0,
+                 margin=10.0):
+        if isinstance(page_size, str):
+            page_size = parse_page_size(page_size)
+        self.page_w, self.page_h = page_size
+        self.rows, self.cols = rows, cols
+        self.gutter, self.bleed, self.margin = gutter, bleed, margin
+        self.cell_w = (self.page_w - 2 * margin - (cols - 1) * gutter) / cols
+        self.cell_h = (self.page_h - 2 * margin - (rows - 1) * gutter) / rows
+        if self.cell_w <= 0 or self.cell_h <= 0:
+            raise ValueError('Sheet grid does not fit on the page; reduce rows, '
+                             'columns, gutter or margin')
+
+    @property
+    def per_page(self):
+        return self.rows * self.cols
+
+    def media_box(self):
+        """
+        The full printed area in points, including bleed.
+        """
+        return (0, 0, (self.page_w + 2 * self.bleed) * MM,
+                (self.page_h + 2 * self.bleed) * MM)
+
+    def trim_box(self):
+        """
+        The finished page in points, inset by the bleed.
+        """
+        b = self.bleed * MM
+        return (b, b, b + self.page_w * MM, b + self.page_h * MM)
+
+    def cell(self, slot):
+        """
+        The (x, y, width, height) box of a slot in PDF points, origin bottom left.
+        """
+        row, col = divmod(slot, self.cols)
+        x = self.bleed + self.margin + col * (self.cell_w + self.gutter)
+        top = self.bleed + self.margin + row * (self.cell_h + self.gutter)
+        y = self.bleed + self.page_h - top - self.cell_h
+        return x * MM, y * MM, self.cell_w * MM, self.cell_h * MM
+
+
+def encode_image(img):
+    """
+    Compress a PIL image into the pieces of a PDF image XObject:
+    (width, height, colour space, bits per component, Flate data).
+    Modes '1' and 'L' stay greyscale; anything else is sent as RGB.
+    """
+    if img.mode == '1':
+        colorspace, bpc = 'DeviceGray', 1
+    elif img.mode == 'L':
+        colorspace, bpc = 'DeviceGray', 8
+    else:
+        colorspace, bpc = 'DeviceRGB', 8
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+    return img.width, img.height, colorspace, bpc, zlib.compress(img.tobytes(), 6)
+
+
+def sheet_label(data, out_path, image_func, **options):
+    """
+    Batch engine render function for sheet output: build the label with
+    image_func(data, **options) and return it encoded for SheetPDFWriter.add,
+    so compression happens in the worker rather than the writing process.
+    """
+    img = image_func(data, **options)
+    with qr_profile.stage('image_encode'):
+        return encode_image(img)
+
+
+class PDFFile:
+    """
+    Minimal append-only PDF writer: objects go straight to disk and only
+    their offsets are kept. Object 1 is the catalog and 2 the page tree,
+    both written when the file is closed. path may also be an open binary
+    file object, which is left open.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._owned = isinstance(path, str)
+        self._f = open(path, 'wb') if self._owned else path
+        self._f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._offsets = [None, None, None]
+        self.kids = []
+
+    def tell(self):
+        return self._f.tell()
+
+    def reserve(self):
+        self._offsets.append(None)
+        return len(self._offsets) - 1
+
+    def write(self, num, body, stream=None):
+        self._offsets[num] = self._f.tell()
+        out = [f'{num} 0 obj\n'.encode('ascii'), body]
+        if stream is not None:
+            out += [b'\nstream\n', stream, b'\nendstream']
+        out.append(b'\nendobj\n')
+        self._f.write(b''.join(out))
+
+    def add(self, body, stream=None):
+        num = self.reserve()
+        self.write(num, body, stream)
+        return num
+
+    def close(self):
+        kids = ' '.join(f'{k} 0 R' for k in self.kids)
+        self.write(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>'
+                   .encode('ascii'))
+        self.write(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref = self._f.tell()
+        lines = [f'xref\n0 {len(self._offsets)}\n', '0000000000 65535 f \n']
+        lines += [f'{off:010d} 00000 n \n' for off in self._offsets[1:]]
+        lines.append(f'trailer\n<< /Size {len(self._offsets)} /Root 1 0 R >>\n'
+                     f'startxref\n{xref}\n%%EOF\n')
+        self._f.write(''.join(lines).encode('ascii'))
+        if self._owned:
+            self._f.close()
+
+
+def _box(box):
+    return '[' + ' '.join(f'{v:.2f}' for v in box) + ']'
+
+
+class SheetPDFWriter:
+    """
+    Stream labels onto multi-up pages of one or more PDF files.
+
+    Each label is written to disk as soon as it is added; only the current
+    page's placements are held in memory. With max_pages and/or max_bytes
+    set, output rolls over to numbered files (labels_001.pdf, ...) once the
+    current file reaches either limit at a page boundary.
+    """
+
+    def __init__(self, path, layout, max_pages=None, max_bytes=None):
+        self.path = path
+        self.layout = layout
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.pages = 0
+        self._pdf = None
+        self._placed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _next_path(self):
+        if not (self.max_pages or self.max_bytes):
+            return self.path
+        base, ext = os.path.splitext(self.path)
+        return f'{base}_{len(self.paths) + 1:03d}{ext or ".pdf"}'
+
+    def add(self, label):
+        """
+        Place one label, given either as a PIL image or as encode_image() output.
+        """
+        if not isinstance(label, tuple):
+            label = encode_image(label)
+        if self._pdf is None:
+            self._pdf = PDFFile(self._next_path())
+            self.paths.append(self._pdf.path)
+        w, h, colorspace, bpc, data = label
+        num = self._pdf.add(
+            (f'<< /Type /XObject /Subtype /Image /Width {w} /Height {h} '
+             f'/ColorSpace /{colorspace} /BitsPerComponent {bpc} '
+             f'/Filter /FlateDecode /Length {len(data)} >>').encode('ascii'),
+            data)
+        self._placed.append((num, w, h))
+        if len(self._placed) == self.layout.per_page:
+            self._finish_page()
+
+    def _finish_page(self):
+        pdf, layout = self._pdf, self.layout
+        ops, xobjects = [], []
+        for slot, (num, w, h) in enumerate(self._placed):
+            x, y, cw, ch = layout.cell(slot)
+            scale = min(cw / w, ch / h)
+            dw, dh = w * scale, h * scale
+            ops.append(f'q {dw:.3f} 0 0 {dh:.3f} {x + (cw - dw) / 2:.3f} '
+                       f'{y + (ch - dh) / 2:.3f} cm /I{slot} Do Q')
+            xobjects.append(f'/I{slot} {num} 0 R')
+        content = '\n'.join(ops).encode('ascii')
+        contents = pdf.add(f'<< /Length {len(content)} >>'.encode('ascii'), content)
+        page = pdf.add(
+            (f'<< /Type /Page /Parent 2 0 R /MediaBox {_box(layout.media_box())} '
+             f'/TrimBox {_box(layout.trim_box())} /Contents {contents} 0 R '
+             f'/Resources << /XObject << {" ".join(xobjects)} >> >> >>').encode('ascii'))
+        pdf.kids.append(page)
+        self._placed = []
+        self.pages += 1
+        if ((self.max_pages and len(pdf.kids) >= self.max_pages)
+                or (self.max_bytes and pdf.tell() >= self.max_bytes)):
+            pdf.close()
+            self._pdf = None
+
+    def close(self):
+        """
+        Flush a partly filled last page and finish the current file.
+        Returns the list of PDF paths written.
+        """
+        if self._placed:
+            self._finish_page()
+        if self._pdf is not None:
+            self._pdf.close()
+            self._pdf = None
+        return self.paths
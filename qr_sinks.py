@@ -0,0 +1,335 @@
+import hashlib
+import io
+import os
+import queue
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+import qr_profile
+from qr_assets import LRUCache
+from qr_verify import check_encoded
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks, hardlinks still work
+    fcntl = None
+
+SINKS = ('dir', 'zip', 'tar', 'stream')
+
+# Buffer size for archive and stream output, so writes reach the file system in bulk
+BUFFER_SIZE = 1024 * 1024
+
+# Background threads that encode and write items for a PipelinedSink
+WRITER_THREADS = 2
+
+# Linux ioctl cloning one file's extents into another (copy-on-write reflink),
+# supported by btrfs, XFS and others
+_FICLONE = 0x40049409
+# How many written files a linking DirectorySink remembers by content
+LINK_SOURCES = 65536
+
+
+def save_format(fmt):
+    """
+    Pillow format name for a user-facing format ('JPG' -> 'JPEG').
+    """
+    fmt = fmt.upper()
+    return 'JPEG' if fmt == 'JPG' else fmt
+
+
+def image_bytes(img, fmt):
+    """
+    Encode a PIL image into an in-memory file and return its bytes.
+    """
+    with qr_profile.stage('image_encode'):
+        buf = io.BytesIO()
+        img.save(buf, save_format(fmt))
+        return buf.getvalue()
+
+
+def encoded_label(data, name, image_func, fmt='JPEG', **options):
+    """
+    Batch engine render function for sinks: build the image with
+    image_func(data, **options) and return it encoded as fmt, so encoding
+    happens in the worker and the parent only has to write bytes. With
+    verify='reload' the encoded bytes are decoded and checked again.
+    """
+    image = image_func(data, **options)
+    payload = image_bytes(image, fmt)
+    if options.get('verify') == 'reload':
+        check_encoded(payload, image)
+    return payload
+
+
+def rendered_label(data, name, image_func, fmt=None, **options):
+    """
+    Like encoded_label but returns the PIL image itself, leaving the encoding
+    to a PipelinedSink's writer threads. Meant for in-process batches, where
+    handing over an image costs nothing (fmt is accepted and ignored so both
+    take the same options).
+    """
+    return image_func(data, **options)
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+
+
+class DirectorySink:
+    """
+    One file per item in a folder (the classic layout).
+
+    With link=True, an item whose bytes match a file already written in this
+    run becomes a reflink (copy-on-write clone) of it, or failing that a
+    hardlink, instead of a second copy. Existing files are always replaced
+    rather than written through, so a hardlinked file from an earlier run
+    never changes its twins.
+    """
+
+    # Items go to separate files, so several threads may write at once
+    thread_safe = True
+    link_methods = ('reflink', 'hardlink')
+
+    def __init__(self, path, link=False):
+        self.path = path
+        self.link = link
+        self.links = dict.fromkeys(self.link_methods, 0)
+        self._sources = LRUCache(LINK_SOURCES)
+        self._unsupported = set()
+        self._lock = threading.Lock()
+        # Subfolders known to exist (names may contain '/', see qr_shard)
+        self._folders = set()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        if '/' in name:
+            folder = os.path.dirname(path)
+            if folder not in self._folders:
+                os.makedirs(folder, exist_ok=True)
+                self._folders.add(folder)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        if self.link:
+            digest = hashlib.sha256(data).digest()
+            source = self._sources.get(digest)
+            if source and self._link(source, path):
+                return
+        with open(path, 'wb') as f:
+            f.write(data)
+        if self.link:
+            # Only complete files are offered as link sources
+            self._sources.put(digest, path)
+
+    def _link(self, source, path):
+        for method in self.link_methods:
+            if method in self._unsupported:
+                continue
+            try:
+                if method == 'reflink':
+                    _reflink(source, path)
+                else:
+                    os.link(source, path)
+            except FileNotFoundError:
+                return False
+            except OSError:
+                # Not supported by this file system; stop trying it
+                self._unsupported.add(method)
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            with self._lock:
+                self.links[method] += 1
+            return True
+        return False
+
+    def close(self):
+        pass
+
+
+class ZipSink:
+    """
+    All items as entries of a single uncompressed (stored) ZIP file.
+    Images are already compressed, so deflating them again would only cost time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb', buffering=BUFFER_SIZE)
+        self._zip = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self._date_time = time.localtime()[:6]
+
+    def write(self, name, data):
+        info = zipfile.ZipInfo(name, self._date_time)
+        info.compress_type = zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+
+    def close(self):
+        self._zip.close()
+        self._file.close()
+
+
+class TarSink:
+    """
+    All items as members of a single uncompressed tar stream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb', buffering=BUFFER_SIZE)
+        self._tar = tarfile.open(fileobj=self._file, mode='w|')
+        self._mtime = time.time()
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self._mtime
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+
+class StreamSink:
+    """
+    Length-prefixed records for piping into other tools. Each record is a
+    4-byte big-endian name length, the UTF-8 name, an 8-byte big-endian data
+    length and the data. A path of '-' writes to stdout.
+    """
+
+    def __init__(self, path='-'):
+        self.path = path
+        if path == '-':
+            self._file = sys.stdout.buffer
+            self._owned = False
+        else:
+            self._file = open(path, 'wb', buffering=BUFFER_SIZE)
+            self._owned = True
+
+    def write(self, name, data):
+        name = name.encode('utf-8')
+        self._file.write(struct.pack('>I', len(name)) + name
+                         + struct.pack('>Q', len(data)))
+        self._file.write(data)
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+
+def read_stream(fp):
+    """
+    Yield (name, data) pairs from a file object written by StreamSink.
+    """
+    while True:
+        head = fp.read(4)
+        if not head:
+            return
+        (name_len,) = struct.unpack('>I', head)
+        name = fp.read(name_len).decode('utf-8')
+        (data_len,) = struct.unpack('>Q', fp.read(8))
+        yield name, fp.read(data_len)
+
+
+class PipelinedSink:
+    """
+    Overlap encoding and writing with rendering. write() hands an item to a
+    bounded queue served by writer threads and only blocks while the queue
+    is full, which caps the memory held by finished items. An item is either
+    bytes or a PIL image, which the writer thread encodes as fmt (Pillow's
+    encoders and file writes release the GIL). Sinks writing one shared file
+    get a single writer thread, so entries keep their order.
+
+    on_written(name, payload) is called after each item is written, one call
+    at a time. Once cancel() returns True, queued items are dropped. An error
+    in a writer thread stops the pipeline and is raised from the next
+    write() or close().
+    """
+
+    def __init__(self, sink, fmt='JPEG', threads=WRITER_THREADS, max_pending=None,
+                 on_written=None, cancel=None):
+        self.sink = sink
+        self.fmt = fmt
+        self.on_written = on_written
+        self.cancel = cancel
+        if not getattr(sink, 'thread_safe', False):
+            threads = 1
+        self._queue = queue.Queue(max_pending or threads * 4)
+        self._lock = threading.Lock()
+        self._error = None
+        self._raised = False
+        self._threads = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(max(1, threads))]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None or (self.cancel and self.cancel()):
+                continue
+            name, data = item
+            try:
+                if not isinstance(data, bytes):
+                    data = image_bytes(data, self.fmt)
+                with qr_profile.stage('write'):
+                    self.sink.write(name, data)
+                if self.on_written:
+                    with self._lock:
+                        self.on_written(name, data)
+            except Exception as e:
+                self._error = e
+
+    def _check(self):
+        if self._error is not None and not self._raised:
+            self._raised = True
+            raise self._error
+
+    def write(self, name, data):
+        self._check()
+        self._queue.put((name, data))
+
+    def close(self):
+        """
+        Wait for the queued items, then close the underlying sink.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.sink.close()
+        self._check()
+
+
+def open_sink(kind, path, link=False):
+    """
+    Create the sink named by kind (one of SINKS) writing to path:
+    a folder for 'dir', an archive file for 'zip'/'tar', a file or '-' for 'stream'.
+    link turns on reflinks/hardlinks for repeated content in a folder.
+    """
+    if kind == 'dir':
+        return DirectorySink(path, link)
+    if kind == 'stream':
+        return StreamSink(path)
+    if kind not in SINKS:
+        raise ValueError(f'Unknown sink {kind!r}, expected one of {SINKS}')
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    return ZipSink(path) if kind == 'zip' else TarSink(path)
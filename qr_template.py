@@ -0,0 +1,233 @@
+import math
+import os
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+import qr_profile
+from qr_assets import LRUCache, file_key, load_background, load_font
+
+# Static layers kept per template; each is a full canvas (or background) image
+LAYERS = 8
+
+_atlases = LRUCache(16)
+_templates = LRUCache(16)
+
+
+class GlyphAtlas:
+    """
+    Glyph masks and advances of one font, rendered once and then stamped
+    wherever the text appears instead of having FreeType lay out and
+    rasterise every label again.
+
+    Pens advance as in Pillow's basic layout (whole-string kerning included,
+    each glyph rounded to the nearest pixel), and black glyphs stamped one by
+    one in text order composite exactly like the mask ImageDraw.text builds,
+    so the result is pixel-identical. Only antialiased text in FreeType fonts
+    laid out by the basic engine qualifies (see supports()): Raqm can form
+    ligatures and mode '1' text is hinted per string.
+    """
+
+    def __init__(self, font):
+        self.font = font
+        self.ascent = font.getmetrics()[0]
+        self._glyphs = {}  # char -> (mask image or None, x, y from the pen on the baseline)
+        self._advances = {}  # (char, next char or '') -> advance in px, kerning included
+
+    @staticmethod
+    def supports(font, mode='RGB'):
+        return (mode != '1' and isinstance(font, ImageFont.FreeTypeFont)
+                and font.layout_engine == ImageFont.Layout.BASIC)
+
+    def _glyph(self, char):
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = self.font.getbbox(char, anchor='ls')
+            mask = None
+            if right > left and bottom > top:
+                mask = Image.new('L', (right - left, bottom - top))
+                ImageDraw.Draw(mask).text((-left, -top), char, font=self.font,
+                                          fill=255, anchor='ls')
+            glyph = self._glyphs[char] = (mask, left, top)
+        return glyph
+
+    def _advance(self, char, following):
+        key = (char, following)
+        advance = self._advances.get(key)
+        if advance is None:
+            advance = self._advances[key] = (self.font.getlength(char + following)
+                                             - self.font.getlength(following))
+        return advance
+
+    def layout(self, text):
+        """
+        Lay out text as ImageDraw.text anchors it at (0, 0). Returns the
+        (mask, x, y, index in text) glyphs to stamp, blanks skipped, and the
+        text's bounding box, equal to font.getbbox(text).
+        """
+        glyphs = []
+        pen = 0.0
+        x0 = x1 = 0
+        y0 = y1 = None
+        for i, char in enumerate(text):
+            mask, left, top = self._glyph(char)
+            x = math.floor(pen + 0.5)
+            if mask is not None:
+                gx, gy = x + left, self.ascent + top
+                glyphs.append((mask, gx, gy, i))
+                x0, x1 = min(x0, gx), max(x1, gx + mask.width)
+                y0 = gy if y0 is None else min(y0, gy)
+                y1 = gy + mask.height if y1 is None else max(y1, gy + mask.height)
+            pen += self._advance(char, text[i + 1:i + 2])
+        x1 = max(x1, math.floor(pen + 0.5))
+        if y0 is None:  # nothing but blanks
+            y0 = y1 = self.ascent
+        return glyphs, (x0, y0, x1, y1)
+
+    @staticmethod
+    def stamp(image, xy, glyphs, ink):
+        """
+        Paste ink through each glyph mask onto image, with the text's origin at xy.
+        """
+        x, y = xy
+        for mask, gx, gy, _ in glyphs:
+            image.paste(ink, (x + gx, y + gy), mask)
+
+
+def glyph_atlas(font_path, font_size):
+    """
+    The cached GlyphAtlas of a font as load_font() opens it.
+    """
+    key = (file_key(font_path), font_size)
+    return _atlases.get_or_create(key, lambda: GlyphAtlas(load_font(font_path, font_size)))
+
+
+class LabelTemplate:
+    """
+    The fixed part of a label style, drawn once: the white label canvas, or
+    a copy of the background image with the label's area cleared. Each item
+    then only pastes its QR bitmap and stamps its text glyphs onto a copy.
+
+    The layout is create_qr_image's: the size x size code inset by
+    qr_margin, and the text centred text_gap below it with
+    text_margin_bottom of space underneath. The canvas height follows each
+    label's text height, so a layer is kept per height and, when a constant
+    prefix/suffix is given to render(), per placement of that text, which
+    is then part of the layer too. Fonts the atlas does not support are
+    drawn with ImageDraw.text on the copy instead.
+    """
+
+    def __init__(self, size=300, qr_margin=0, font_size=14, font_path=None, text_gap=0,
+                 text_margin_bottom=10, bg_file='', bg_offset=(0, 0), color_mode='RGB'):
+        self.size = size
+        self.qr_margin = qr_margin
+        self.text_gap = text_gap
+        self.text_margin_bottom = text_margin_bottom
+        self.color_mode = color_mode
+        self.font = load_font(font_path, font_size)
+        self.atlas = (glyph_atlas(font_path, font_size)
+                      if GlyphAtlas.supports(self.font, color_mode) else None)
+        self.background = None
+        self.origin = (0, 0)
+        if bg_file and os.path.isfile(bg_file):
+            try:
+                with qr_profile.stage('background'):
+                    self.background = load_background(bg_file)
+                self.origin = tuple(bg_offset)
+            except Exception:
+                pass  # as compose_image: an unreadable background is left out
+        mode = 'RGB' if self.background else color_mode
+        self.ink = ImageColor.getcolor('black', mode)
+        self.paper = ImageColor.getcolor('white', mode)
+        self._layers = LRUCache(LAYERS)
+
+    def _layer(self, width, height, text='', static=(), text_xy=(0, 0)):
+        """
+        The blank canvas of one label height, with any static glyphs stamped on.
+        """
+        def build():
+            if self.background is None:
+                layer = Image.new(self.color_mode, (width, height), self.paper)
+            else:
+                layer = self.background.copy()
+                x, y = self.origin
+                layer.paste(self.paper, (x, y, x + width, y + height))
+            if static:
+                self.atlas.stamp(layer, text_xy, static, self.ink)
+            return layer
+
+        key = (height, text_xy, tuple((text[g[3]], g[1], g[2]) for g in static)) if static else height
+        return self._layers.get_or_create(key, build)
+
+    def render(self, qr_img, text, prefix='', suffix=''):
+        """
+        The finished label (on its background, if any) for a rendered QR
+        image and its text. prefix and suffix name constant ends of text
+        (e.g. of a numbered sequence) that can be kept in the static layer.
+        """
+        width = self.size + self.qr_margin * 2
+        top = self.size + self.qr_margin * 2 + self.text_gap
+        with qr_profile.stage('text.measure'):
+            if self.atlas is None:
+                glyphs, bbox = None, self.font.getbbox(text)
+            else:
+                glyphs, bbox = self.atlas.layout(text)
+        height = top + bbox[3] - bbox[1] + self.text_margin_bottom
+        text_x = (width - bbox[2] + bbox[0]) // 2
+        # A code with a negative margin, or text, running past the label's edges
+        # is clipped there, not drawn onto the background
+        clip = self.background is not None and (
+            self.qr_margin < 0
+            or text_x + bbox[0] < 0 or text_x + bbox[2] > width
+            or top + bbox[1] < 0 or top + bbox[3] > height)
+        with qr_profile.stage('compose'):
+            if clip:
+                canvas = Image.new('RGB', (width, height), self.paper)
+                ox, oy = 0, 0
+            else:
+                ox, oy = self.origin
+                static = ()
+                # Static glyphs sit under the code, so only when the code stays clear of the text
+                if (glyphs and (prefix or suffix) and len(prefix) + len(suffix) <= len(text)
+                        and self.qr_margin + self.size <= top + bbox[1]
+                        and text.startswith(prefix) and text.endswith(suffix)):
+                    static, glyphs = _split_static(text, glyphs, prefix, suffix)
+                canvas = self._layer(width, height, text, static, (ox + text_x, oy + top)).copy()
+            canvas.paste(qr_img, (ox + self.qr_margin, oy + self.qr_margin))
+            if glyphs is None:
+                draw = ImageDraw.Draw(canvas)
+                if self.color_mode == '1':
+                    draw.fontmode = '1'  # as on a mode '1' label, even on a background
+                draw.text((ox + text_x, oy + top), text, font=self.font, fill=self.ink)
+            else:
+                self.atlas.stamp(canvas, (ox + text_x, oy + top), glyphs, self.ink)
+            if clip:
+                label, canvas = canvas, self._layer(width, height).copy()
+                canvas.paste(label, self.origin)
+        return canvas
+
+
+def label_template(**style):
+    """
+    The cached LabelTemplate for a style, given as LabelTemplate's keyword
+    arguments. Edits to the font or background file make a new one.
+    """
+    key = (tuple(sorted(style.items())), file_key(style.get('font_path')),
+           file_key(style.get('bg_file')))
+    return _templates.get_or_create(key, lambda: LabelTemplate(**style))
+
+
+def _split_static(text, glyphs, prefix, suffix):
+    """
+    Split laid-out glyphs into those of a constant prefix/suffix and the
+    variable rest. Overlapping glyphs have to be stamped in text order, so
+    suffix glyphs only become static when none of them reach into the
+    variable glyphs' columns.
+    """
+    head, tail = len(prefix), len(text) - len(suffix)
+    static = [g for g in glyphs if g[3] < head]
+    variable = [g for g in glyphs if head <= g[3] < tail]
+    ending = [g for g in glyphs if g[3] >= tail]
+    if ending and variable:
+        if min(g[1] for g in ending) < max(g[1] + g[0].width for g in variable):
+            return static, variable + ending
+    return static + ending, variable
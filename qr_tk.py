@@ -2,14 +2,36 @@
 import threading
 import re
 import sys
-import codecs
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from tkinter import StringVar, IntVar, ttk
 
-import qrcode
-from PIL import Image, ImageDraw, ImageFont, ImageTk
+from PIL import ImageTk
+
+import qr_verify
+from qr_engine import BatchRun, default_workers, label_render
+from qr_input import input_summary, parse_column, read_input_file
+from qr_label import (SHEET_FORMAT, VECTOR_PDF_FORMAT, compose_image, create_qr_vector,
+                      file_extension)
+from qr_progress import ProgressChannel
+from qr_shard import place_jobs, subdir
+from qr_sheet import PAGE_SIZES, SheetLayout, SheetPDFWriter, parse_grid, sheet_label
+
+# Quiet period after the last edit before the preview is re-rendered
+PREVIEW_DELAY_MS = 150
+# How often the UI picks up batch progress, and how much log it keeps
+PROGRESS_POLL_MS = 200
+LOG_MAX_LINES = 1000
+# Color modes shown in the GUI -> PIL canvas mode
+COLOR_MODE_NAMES = {'Color': 'RGB', 'Grayscale': 'L', '1-bit': '1'}
+# Subfolder choices shown in the GUI -> qr_shard layout
+SUBDIR_NAMES = {'None': 'none', 'Hashed (256 folders)': 'hash',
+                'By number (1000 per folder)': 'range'}
+# Output choices shown in the GUI -> (sink kind, archive name inside the output folder)
+OUTPUT_SINKS = {'Folder': ('dir', None),
+                'ZIP archive': ('zip', 'qr_codes.zip'),
+                'TAR archive': ('tar', 'qr_codes.tar')}
 
 # --- Enable high-DPI awareness on Windows ---
 if sys.platform == 'win32':
@@ -20,67 +42,6 @@ if sys.platform == 'win32':
         pass
 
 
-def read_input_file(path):
-    """
-    Read a text or CSV file and return its lines as a list of strings.
-
-    Supports UTF-8 with optional BOM (utf-8-sig), UTF-16, and falls back to latin-1 encoding.
-    Strips trailing carriage returns and newlines from each line.
-    """
-    # Try common encodings
-    for enc in ('utf-8-sig', 'utf-16'):
-        try:
-            with codecs.open(path, encoding=enc) as f:
-                return f.read().splitlines()
-        except Exception:
-            pass
-    # Fallback to latin-1
-    with open(path, encoding='latin-1') as f:
-        return [line.rstrip('\r\n') for line in f]
-
-
-def create_qr_image(data, size=300, qr_margin=0,
-                    font_size=14, font_path=None,
-                    text_margin_bottom=10):
-    qr = qrcode.QRCode(border=2)
-    qr.add_data(data)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color='black', back_color='white').convert('RGB')
-    img_qr = img_qr.resize((size, size), Image.NEAREST)
-    try:
-        font = ImageFont.truetype(font_path or 'arial.ttf', font_size)
-    except Exception:
-        font = ImageFont.load_default()
-    # measure text size using textbbox
-    temp_img = Image.new('RGB', (1, 1))
-    temp_draw = ImageDraw.Draw(temp_img)
-    bbox = temp_draw.textbbox((0, 0), data, font=font)
-    text_w = bbox[2] - bbox[0]
-    text_h = bbox[3] - bbox[1]
-    # calculate canvas size
-    canvas_w = size + qr_margin * 2
-    canvas_h = size + qr_margin * 2 + text_h + text_margin_bottom
-    canvas = Image.new('RGB', (canvas_w, canvas_h), 'white')
-    canvas.paste(img_qr, (qr_margin, qr_margin))
-    draw = ImageDraw.Draw(canvas)
-    text_x = (canvas_w - text_w) // 2
-    text_y = size + qr_margin * 2
-    draw.text((text_x, text_y), data, font=font, fill='black')
-    return canvas
-
-
-def make_qr_with_label(data, out_path, fmt='JPG', size=300,
-                       qr_margin=0, font_size=14, font_path=None,
-                       text_margin_bottom=10):
-    img = create_qr_image(data, size, qr_margin,
-                           font_size, font_path,
-                           text_margin_bottom)
-    save_fmt = 'JPEG' if fmt.upper() in ('JPG', 'JPEG') else fmt.upper()
-    ext = 'jpg' if fmt.upper() in ('JPG', 'JPEG') else fmt.lower()
-    out_path = os.path.splitext(out_path)[0] + f'.{ext}'
-    img.save(out_path, save_fmt)
-
-
 class QRApp:
     def __init__(self, root):
         self.root = root
@@ -125,27 +86,32 @@ class QRApp:
         ttk.Checkbutton(src, text='Skip header row', variable=self.skip_header,
                         command=self.on_datafile_change).grid(row=1, column=1, sticky='w', pady=2)
 
-        ttk.Label(src, text='Output folder:').grid(row=2, column=0, sticky='e', padx=5)
+        ttk.Label(src, text='CSV column:').grid(row=2, column=0, sticky='e', padx=5)
+        self.column = ttk.Entry(src, width=12)
+        self.column.grid(row=2, column=1, sticky='w', padx=5, pady=2)
+        self.column.bind('<KeyRelease>', self.on_datafile_change)
+
+        ttk.Label(src, text='Output folder:').grid(row=3, column=0, sticky='e', padx=5)
         self.outd = ttk.Entry(src)
-        self.outd.grid(row=2, column=1, sticky='ew', padx=5)
-        ttk.Button(src, text='Browse…', command=self.browse_folder).grid(row=2, column=2, padx=5)
+        self.outd.grid(row=3, column=1, sticky='ew', padx=5)
+        ttk.Button(src, text='Browse…', command=self.browse_folder).grid(row=3, column=2, padx=5)
 
         # Background image option
-        ttk.Label(src, text='Background image:').grid(row=3, column=0, sticky='e', padx=5)
+        ttk.Label(src, text='Background image:').grid(row=4, column=0, sticky='e', padx=5)
         self.bg_path_var = StringVar()
         self.bg_path = ttk.Entry(src, textvariable=self.bg_path_var)
-        self.bg_path.grid(row=3, column=1, sticky='ew', padx=5)
+        self.bg_path.grid(row=4, column=1, sticky='ew', padx=5)
         self.bg_path_var.trace_add('write', lambda *_: self.update_preview())
-        ttk.Button(src, text='Browse…', command=self.browse_background).grid(row=3, column=2, padx=5)
+        ttk.Button(src, text='Browse…', command=self.browse_background).grid(row=4, column=2, padx=5)
         # QR offset on background
-        ttk.Label(src, text='QR X offset:').grid(row=4, column=0, sticky='e', padx=5)
+        ttk.Label(src, text='QR X offset:').grid(row=5, column=0, sticky='e', padx=5)
         self.bg_x = IntVar(value=0)
         ttk.Spinbox(src, from_=0, to=10000, textvariable=self.bg_x, width=7,
-                    command=self.update_preview).grid(row=4, column=1, sticky='w', padx=5, pady=2)
-        ttk.Label(src, text='QR Y offset:').grid(row=5, column=0, sticky='e', padx=5)
+                    command=self.update_preview).grid(row=5, column=1, sticky='w', padx=5, pady=2)
+        ttk.Label(src, text='QR Y offset:').grid(row=6, column=0, sticky='e', padx=5)
         self.bg_y = IntVar(value=0)
         ttk.Spinbox(src, from_=0, to=10000, textvariable=self.bg_y, width=7,
-                    command=self.update_preview).grid(row=5, column=1, sticky='w', padx=5, pady=2)
+                    command=self.update_preview).grid(row=6, column=1, sticky='w', padx=5, pady=2)
 
         # --- Naming Frame ---
         naming = ttk.LabelFrame(self.left, text='Naming')
@@ -178,7 +144,8 @@ class QRApp:
         ttk.Label(naming, text='Format:').grid(row=5, column=0, sticky='e', padx=5)
         self.fmt = StringVar(value='JPG')
         fmt_menu = ttk.Combobox(naming, textvariable=self.fmt, state='readonly',
-                                values=['JPG', 'PNG', 'PDF'], width=8)
+                                values=['JPG', 'PNG', 'PDF', 'SVG', VECTOR_PDF_FORMAT, SHEET_FORMAT],
+                                width=12)
         fmt_menu.grid(row=5, column=1, sticky='w', padx=5)
         fmt_menu.bind('<<ComboboxSelected>>', lambda e: self.update_preview())
 
@@ -186,6 +153,26 @@ class QRApp:
         self.filename_preview = ttk.Entry(naming, state='readonly')
         self.filename_preview.grid(row=6, column=1, sticky='ew', padx=5)
 
+        ttk.Label(naming, text='Output:').grid(row=7, column=0, sticky='e', padx=5)
+        self.output_sink = StringVar(value='Folder')
+        ttk.Combobox(naming, textvariable=self.output_sink, state='readonly',
+                     values=list(OUTPUT_SINKS), width=12).grid(row=7, column=1, sticky='w', padx=5, pady=2)
+
+        ttk.Label(naming, text='Subfolders:').grid(row=8, column=0, sticky='e', padx=5)
+        self.subdirs = StringVar(value='None')
+        subdir_menu = ttk.Combobox(naming, textvariable=self.subdirs, state='readonly',
+                                   values=list(SUBDIR_NAMES), width=24)
+        subdir_menu.grid(row=8, column=1, sticky='w', padx=5, pady=2)
+        subdir_menu.bind('<<ComboboxSelected>>', lambda e: self.update_preview())
+
+        self.use_manifest = tk.BooleanVar()
+        ttk.Checkbutton(naming, text='Skip up-to-date files (manifest.csv)',
+                        variable=self.use_manifest).grid(row=9, column=1, sticky='w', padx=5)
+
+        self.verify = tk.BooleanVar()
+        ttk.Checkbutton(naming, text='Verify QR codes before saving',
+                        variable=self.verify).grid(row=10, column=1, sticky='w', padx=5)
+
         # --- Styling Frame ---
         stylef = ttk.LabelFrame(self.left, text='Styling')
         stylef.grid(row=2, column=0, sticky='ew', padx=5, pady=5)
@@ -216,12 +203,62 @@ class QRApp:
                               command=self.update_preview)
         sb_txt.grid(row=3, column=1, sticky='w', padx=5, pady=2)
 
+        self.remask = tk.BooleanVar()
+        ttk.Checkbutton(stylef, text='Best mask per item (slower)',
+                        variable=self.remask).grid(row=4, column=1, sticky='w', padx=5)
+
+        ttk.Label(stylef, text='Color mode:').grid(row=5, column=0, sticky='e', padx=5)
+        self.color_mode = StringVar(value='Color')
+        mode_menu = ttk.Combobox(stylef, textvariable=self.color_mode, state='readonly',
+                                 values=list(COLOR_MODE_NAMES), width=12)
+        mode_menu.grid(row=5, column=1, sticky='w', padx=5, pady=2)
+        mode_menu.bind('<<ComboboxSelected>>', lambda e: self.update_preview())
+
+        # --- Sheet Frame (used by the 'PDF sheet' format) ---
+        sheetf = ttk.LabelFrame(self.left, text='Sheet layout')
+        sheetf.grid(row=3, column=0, sticky='ew', padx=5, pady=5)
+        sheetf.columnconfigure(1, weight=1)
+
+        ttk.Label(sheetf, text='Page size:').grid(row=0, column=0, sticky='e', padx=5)
+        self.page_size = StringVar(value='A4')
+        ttk.Combobox(sheetf, textvariable=self.page_size, width=10,
+                     values=[name.title() if len(name) > 2 else name for name in PAGE_SIZES]
+                     ).grid(row=0, column=1, sticky='w', padx=5, pady=2)
+
+        ttk.Label(sheetf, text='Rows x columns:').grid(row=1, column=0, sticky='e', padx=5)
+        self.sheet_grid = StringVar(value='8x3')
+        ttk.Entry(sheetf, textvariable=self.sheet_grid, width=10).grid(
+            row=1, column=1, sticky='w', padx=5, pady=2)
+
+        ttk.Label(sheetf, text='Gutter (mm):').grid(row=2, column=0, sticky='e', padx=5)
+        self.gutter = tk.DoubleVar(value=2.0)
+        ttk.Spinbox(sheetf, from_=0, to=50, increment=0.5, textvariable=self.gutter,
+                    width=7).grid(row=2, column=1, sticky='w', padx=5, pady=2)
+
+        ttk.Label(sheetf, text='Bleed (mm):').grid(row=3, column=0, sticky='e', padx=5)
+        self.bleed = tk.DoubleVar(value=0.0)
+        ttk.Spinbox(sheetf, from_=0, to=20, increment=0.5, textvariable=self.bleed,
+                    width=7).grid(row=3, column=1, sticky='w', padx=5, pady=2)
+
         # --- Actions Frame ---
         actf = ttk.Frame(self.left)
-        actf.grid(row=3, column=0, sticky='ew', padx=5, pady=5)
+        actf.grid(row=4, column=0, sticky='ew', padx=5, pady=5)
         ttk.Button(actf, text='Generate', command=self.start_generate).pack(side='left', padx=5)
         self.cancel_btn = ttk.Button(actf, text='Stop', command=self.cancel_generate, state='disabled')
         self.cancel_btn.pack(side='left', padx=5)
+        ttk.Label(actf, text='Workers:').pack(side='left', padx=(15, 5))
+        self.workers = IntVar(value=default_workers())
+        ttk.Spinbox(actf, from_=1, to=256, textvariable=self.workers,
+                    width=4).pack(side='left')
+
+        # --- Progress Frame ---
+        progf = ttk.Frame(self.left)
+        progf.grid(row=5, column=0, sticky='ew', padx=5, pady=5)
+        progf.columnconfigure(0, weight=1)
+        self.progress_bar = ttk.Progressbar(progf, mode='determinate')
+        self.progress_bar.grid(row=0, column=0, sticky='ew', padx=5)
+        self.progress_label = ttk.Label(progf, text='')
+        self.progress_label.grid(row=1, column=0, sticky='w', padx=5)
 
         # --- Preview Frame ---
         prevf = ttk.LabelFrame(self.right, text='Preview')
@@ -240,21 +277,31 @@ class QRApp:
         self.log.pack(fill='both', expand=True, padx=5, pady=5)
 
         self.cancel_flag = False
+
+        # Preview rendering runs on a background thread; only the most
+        # recent request is rendered and only its result is shown
+        self._preview_after = None
+        self._preview_seq = 0
+        self._preview_request = None
+        self._preview_lock = threading.Lock()
+        self._preview_event = threading.Event()
+        threading.Thread(target=self._preview_loop, daemon=True).start()
+
         self.on_datafile_change()
 
     def on_datafile_change(self, event=None):
         path = self.inp.get().strip()
-        if os.path.isfile(path):
-            self.quantity.config(state='normal')
-            lines = read_input_file(path)
-            start = 1 if self.skip_header.get() else 0
-            count = len(lines) - start
-            self.quantity.set(count)
-            self.quantity.config(state='disabled')
-        else:
-            self.quantity.config(state='normal')
+        # For a data file the row count arrives with the next preview
+        self.quantity.config(state='disabled' if os.path.isfile(path) else 'normal')
         self.update_preview()
 
+    def _reader_options(self):
+        """
+        Keyword arguments for read_input_file taken from the Source settings.
+        """
+        return dict(column=parse_column(self.column.get()),
+                    skip_header=self.skip_header.get())
+
     def browse_file(self):
         path = filedialog.askopenfilename(filetypes=[('Text/CSV','*.txt;*.csv')])
         if path:
@@ -281,118 +328,274 @@ class QRApp:
     def start_generate(self):
         self.cancel_btn.config(state='normal')
         self.cancel_flag = False
-        threading.Thread(target=self._generate_worker, daemon=True).start()
+        self._log_clear()
+        self.progress_bar.config(value=0)
+        progress = ProgressChannel()
+        threading.Thread(target=self._run_generate, args=(progress,), daemon=True).start()
+        self.root.after(PROGRESS_POLL_MS, self._poll_progress, progress)
+
+    def _run_generate(self, progress):
+        try:
+            self._generate_worker(progress)
+        except Exception as e:
+            progress.message(f'✗ {e}')
+        finally:
+            if not progress.finished:
+                progress.finish()
+
+    def _poll_progress(self, progress):
+        """
+        Pull queued log messages and counters from the batch thread on a
+        timer, rather than having it schedule a Tk callback per item.
+        """
+        for msg in progress.drain():
+            self.log_print(msg)
+        if progress.total:
+            self.progress_bar.config(maximum=progress.total, value=progress.done)
+        self.progress_label.config(text=progress.status() if progress.done else '')
+        if progress.idle():
+            self.cancel_btn.config(state='disabled')
+        else:
+            self.root.after(PROGRESS_POLL_MS, self._poll_progress, progress)
 
     def cancel_generate(self):
         self.cancel_flag = True
 
-    def _generate_worker(self):
+    def _generate_worker(self, progress):
         infile = self.inp.get().strip()
         outdir = self.outd.get().strip()
         fmt = self.fmt.get().upper()
-        skip = self.skip_header.get()
+        reader_options = self._reader_options()
         use_data = self.use_data.get()
         pad = self.pad_zeros.get()
         fs = self.font_size.get()
         qr_m = self.qr_margin.get()
         txt_m = self.text_margin.get()
 
-        self._log_clear()
         if not os.path.isdir(outdir):
             self.root.after(0, lambda: messagebox.showerror('Error','Output folder not found.'))
+            progress.finish()
             return
         if os.path.isfile(infile):
-            lines = read_input_file(infile)
-            data_lines = lines[1:] if skip else lines
+            data_lines = read_input_file(infile, **reader_options)
+            # Usually already cached by the preview
+            try:
+                total = input_summary(infile, **reader_options)[1]
+            except ValueError:
+                total = 0
         else:
-            qty = int(self.quantity.get()) if self.quantity.get().isdigit() else 1
-            data_lines = [None] * qty
+            # Numbered sequence, generated lazily from the index
+            data_lines = None
+            total = int(self.quantity.get()) if self.quantity.get().isdigit() else 1
 
-        total = len(data_lines)
+        progress.total = total
         width = len(str(total)) if pad else 0
-        for i, item in enumerate(data_lines, start=1):
-            if self.cancel_flag:
-                break
-            if item is not None and use_data:
-                val = item.strip()
-                base = re.sub(r'[\/:*?"<>|]','_', val)
-            else:
-                idx_str = str(i).zfill(width) if pad else str(i)
-                base = f"{self.prefix.get()}{idx_str}{self.suffix.get()}"
-                val = base
-            filename = f"{base}.{('jpg' if fmt=='JPG' else fmt.lower())}"
-            out_path = os.path.join(outdir, filename)
-            try:
-                # generate QR canvas
-                qr_img = create_qr_image(val, size=self.qr_size.get(),
-                                          qr_margin=qr_m, font_size=fs,
-                                          text_margin_bottom=txt_m)
-                # composite onto background
-                bg_file = self.bg_path_var.get().strip()
-                if bg_file and os.path.isfile(bg_file):
-                    try:
-                        bg = Image.open(bg_file).convert('RGB')
-                        bg.paste(qr_img, (self.bg_x.get(), self.bg_y.get()))
-                        to_save = bg
-                    except Exception:
-                        to_save = qr_img
+        prefix, suffix = self.prefix.get(), self.suffix.get()
+        ext = file_extension(fmt)
+
+        def jobs():
+            if data_lines is None:
+                for i in range(1, total + 1):
+                    base = f"{prefix}{str(i).zfill(width)}{suffix}"
+                    yield i, base, f"{base}.{ext}"
+                return
+            for i, item in enumerate(data_lines, start=1):
+                if use_data:
+                    val = item.strip()
+                    base = re.sub(r'[\/:*?"<>|]','_', val)
                 else:
-                    to_save = qr_img
-                save_fmt = 'JPEG' if fmt == 'JPG' else fmt.lower()
-                to_save.save(out_path, save_fmt)
-                self.root.after(0, lambda f=filename: self.log_print(f'✓ {f}'))
-            except Exception as e:
-                self.root.after(0, lambda i=i,e=e: self.log_print(f'✗ {i}: {e}'))
-        if not self.cancel_flag:
-            self.root.after(0, lambda: self.log_print('Done!'))
-        self.cancel_btn.config(state='disabled')
-
-    def update_preview(self):
-        infile = self.inp.get().strip()
+                    idx_str = str(i).zfill(width) if pad else str(i)
+                    base = f"{prefix}{idx_str}{suffix}"
+                    val = base
+                yield i, val, f"{base}.{ext}"
+
+        # Numbered runs share one payload shape, so the version/mask search
+        # can be done once instead of per item
+        if os.path.isfile(infile) and use_data:
+            encoder = 'fit'
+        else:
+            encoder = 'sequence-remask' if self.remask.get() else 'sequence'
+        options = dict(size=self.qr_size.get(), qr_margin=qr_m,
+                       font_size=fs, text_margin_bottom=txt_m,
+                       bg_file=self.bg_path_var.get().strip(),
+                       bg_offset=(self.bg_x.get(), self.bg_y.get()),
+                       encoder=encoder,
+                       color_mode=COLOR_MODE_NAMES.get(self.color_mode.get(), 'RGB'))
+        if (prefix or suffix) and not (os.path.isfile(infile) and use_data):
+            # Numbered labels share their prefix/suffix, drawn once per batch
+            options['static_text'] = (prefix, suffix)
+        try:
+            workers = max(1, self.workers.get())
+        except tk.TclError:
+            workers = 1
+        # Data files often repeat values; render each distinct one only once
+        # (numbered labels never repeat, so they keep writer-thread encoding)
+        reuse = os.path.isfile(infile) and use_data
+        sheet = None
+        kind, archive = OUTPUT_SINKS.get(self.output_sink.get(), ('dir', None))
+        if fmt == SHEET_FORMAT.upper():
+            # Workers return encoded labels which are placed here onto shared pages
+            try:
+                layout = SheetLayout(self.page_size.get(), *parse_grid(self.sheet_grid.get()),
+                                     gutter=self.gutter.get(), bleed=self.bleed.get())
+            except (ValueError, tk.TclError) as e:
+                self.root.after(0, lambda e=e: messagebox.showerror('Error', str(e)))
+                progress.finish()
+                return
+            sheet = SheetPDFWriter(os.path.join(outdir, 'labels.pdf'), layout)
+            render = sheet_label
+            options['image_func'] = compose_image
+        elif fmt in ('SVG', VECTOR_PDF_FORMAT.upper()):
+            # Workers return finished SVG/PDF documents; backgrounds are raster-only
+            render = create_qr_vector
+            if options.pop('bg_file'):
+                progress.message('Background image is not used for vector output.')
+            del options['bg_offset'], options['color_mode']
+            options.pop('static_text', None)
+            options['fmt'] = 'SVG' if fmt == 'SVG' else 'PDF'
+        else:
+            # Workers return the image or its encoded bytes; the sink writes them here
+            render = label_render(workers, dedup=reuse)
+            options['image_func'] = compose_image
+            options['fmt'] = fmt
+        batch_jobs = jobs()
+        if not sheet:
+            batch_jobs = place_jobs(batch_jobs, SUBDIR_NAMES.get(self.subdirs.get(), 'none'))
+        verify = self.verify.get() and render is not create_qr_vector
+        if verify and not qr_verify.available():
+            progress.message('Verification needs NumPy; outputs are not checked.')
+            verify = False
+        use_manifest = not sheet and self.use_manifest.get()
+        batch = BatchRun(render, options, os.path.join(outdir, archive) if archive else outdir,
+                         kind, sheet=sheet, fmt=fmt,
+                         manifest=os.path.join(outdir, 'manifest.csv') if use_manifest else None,
+                         dedup='bytes' if reuse else None, verify='image' if verify else None)
+        try:
+            batch.run(batch_jobs, workers=workers, cancel=lambda: self.cancel_flag,
+                      on_result=lambda i, name, error: progress.item_done(error, label=i),
+                      on_skip=lambda i, name: progress.item_skipped())
+        except ValueError as e:
+            self.root.after(0, lambda e=e: messagebox.showerror('Error', str(e)))
+        for note in batch.notes():
+            progress.message(note)
+        if batch.unverified:
+            progress.message(f'{batch.unverified:,} output(s) failed verification '
+                             'and were not saved')
+        if sheet:
+            for path in sheet.close():
+                progress.message(f'✓ {os.path.basename(path)}')
+        progress.finish('Stopped.' if self.cancel_flag else 'Done!')
+
+    def update_preview(self, *_):
+        """
+        Schedule a preview refresh once edits pause for PREVIEW_DELAY_MS.
+        """
+        if self._preview_after is not None:
+            self.root.after_cancel(self._preview_after)
+        self._preview_after = self.root.after(PREVIEW_DELAY_MS, self._request_preview)
+
+    def _request_preview(self):
+        """
+        Snapshot the settings (Tk variables may only be read here, on the
+        main thread) and hand them to the preview thread.
+        """
+        self._preview_after = None
+        try:
+            style = dict(size=self.qr_size.get(),
+                         qr_margin=self.qr_margin.get(),
+                         font_size=self.font_size.get(),
+                         text_margin_bottom=self.text_margin.get(),
+                         bg_file=self.bg_path_var.get().strip(),
+                         bg_offset=(self.bg_x.get(), self.bg_y.get()),
+                         color_mode=COLOR_MODE_NAMES.get(self.color_mode.get(), 'RGB'))
+        except tk.TclError:
+            return  # a spinbox holds a half-typed value
+        request = dict(infile=self.inp.get().strip(),
+                       reader_options=self._reader_options(),
+                       quantity=self.quantity.get(),
+                       pad=self.pad_zeros.get(),
+                       prefix=self.prefix.get(),
+                       suffix=self.suffix.get(),
+                       use_data=self.use_data.get(),
+                       fmt=self.fmt.get().upper(),
+                       subdirs=SUBDIR_NAMES.get(self.subdirs.get(), 'none'),
+                       box=(self.preview_canvas.winfo_width() - 10,
+                            self.preview_canvas.winfo_height() - 10),
+                       style=style)
+        with self._preview_lock:
+            self._preview_seq += 1
+            self._preview_request = (self._preview_seq, request)
+        self._preview_event.set()
+
+    def _preview_loop(self):
+        while True:
+            self._preview_event.wait()
+            self._preview_event.clear()
+            with self._preview_lock:
+                seq, request = self._preview_request
+            try:
+                result = self._render_preview(request)
+            except Exception:
+                continue
+            self.root.after(0, lambda s=seq, r=result: self._apply_preview(s, r))
+
+    @staticmethod
+    def _render_preview(req):
+        """
+        Work out the preview text, file name and image for a request.
+        Runs on the preview thread, so it must not touch any Tk widgets.
+        """
+        infile = req['infile']
+        count = None
         # Determine display text
         if os.path.isfile(infile):
-            lines = read_input_file(infile)
-            start = 1 if self.skip_header.get() else 0
-            data_lines = lines[start:]
-            display = data_lines[0].strip() if data_lines else ''
+            try:
+                display, count = input_summary(infile, **req['reader_options'])
+                display = display.strip()
+            except ValueError:
+                display, count = '', 0
         else:
-            total = int(self.quantity.get()) if self.quantity.get().isdigit() else 1
-            idx_str = str(1).zfill(len(str(total))) if self.pad_zeros.get() else '1'
-            display = f"{self.prefix.get()}{idx_str}{self.suffix.get()}"
-        # Update filename preview
-        fmt = self.fmt.get().upper()
-        if os.path.isfile(infile) and self.use_data.get():
+            qty = req['quantity']
+            total = int(qty) if qty.isdigit() else 1
+            idx_str = str(1).zfill(len(str(total))) if req['pad'] else '1'
+            display = f"{req['prefix']}{idx_str}{req['suffix']}"
+        # Filename preview
+        fmt = req['fmt']
+        if os.path.isfile(infile) and req['use_data']:
             base = re.sub(r'[\/\:*?"<>|]', '_', display)
         else:
             base = display
-        ext = 'jpg' if fmt == 'JPG' else fmt.lower()
-        preview_fname = f"{base}.{ext}"
+        if fmt == SHEET_FORMAT.upper():
+            fname = 'labels.pdf'
+        else:
+            fname = f"{base}.{file_extension(fmt)}"
+            if req['subdirs'] != 'none':
+                fname = f"{subdir(fname, 1, req['subdirs'])}/{fname}"
+
+        # Generate QR image with dynamic size, composited onto any background,
+        # then shrink it to fit the preview widget
+        img = compose_image(display or ' ', **req['style'])
+        if img.mode == '1':
+            img = img.convert('L')  # smoother thumbnail
+        box_w, box_h = req['box']
+        if box_w > 1 and box_h > 1 and (img.width > box_w or img.height > box_h):
+            img.thumbnail((box_w, box_h))
+        return fname, count, img
+
+    def _apply_preview(self, seq, result):
+        if seq != self._preview_seq:
+            return  # a newer request is already on its way
+        fname, count, img = result
         self.filename_preview.config(state='normal')
         self.filename_preview.delete(0, tk.END)
-        self.filename_preview.insert(0, preview_fname)
+        self.filename_preview.insert(0, fname)
         self.filename_preview.config(state='readonly')
-
-        # Generate QR image with dynamic size
-        qr_img = create_qr_image(
-            display or ' ',
-            size=self.qr_size.get(),
-            qr_margin=self.qr_margin.get(),
-            font_size=self.font_size.get(),
-            text_margin_bottom=self.text_margin.get()
-        )
-        # Composite onto background if provided
-        bg_file = self.bg_path_var.get().strip()
-        if bg_file and os.path.isfile(bg_file):
-            try:
-                bg = Image.open(bg_file).convert('RGB')
-                bg.paste(qr_img, (self.bg_x.get(), self.bg_y.get()))
-                final_img = bg
-            except Exception:
-                final_img = qr_img
-        else:
-            final_img = qr_img
+        if count is not None:
+            self.quantity.config(state='normal')
+            self.quantity.set(count)
+            self.quantity.config(state='disabled')
         # Update Tkinter preview
-        tkimg = ImageTk.PhotoImage(final_img)
+        tkimg = ImageTk.PhotoImage(img)
         self.preview_canvas.config(image=tkimg)
         self.preview_canvas.image = tkimg
 
@@ -404,11 +607,17 @@ class QRApp:
     def log_print(self, msg):
         self.log.config(state='normal')
         self.log.insert(tk.END, msg + '\n')
+        # Keep only the last LOG_MAX_LINES lines
+        lines = int(self.log.index('end-1c').split('.')[0]) - 1
+        if lines > LOG_MAX_LINES:
+            self.log.delete('1.0', f'{lines - LOG_MAX_LINES + 1}.0')
         self.log.see(tk.END)
         self.log.config(state='disabled')
 
 
 if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = QRApp(root)
     root.mainloop()
@@ -0,0 +1,132 @@
+import io
+from xml.sax.saxutils import escape, quoteattr
+
+import qr_profile
+from qr_assets import load_font, text_size
+from qr_encode import make_qr
+from qr_sheet import PDFFile
+
+VECTOR_FORMATS = ('SVG', 'PDF')
+
+
+def module_rects(matrix):
+    """
+    Cover the dark modules of a QR matrix with (x, y, width, height)
+    rectangles in module units: each row is split into runs of adjacent dark
+    modules, and identical runs in consecutive rows are merged into one
+    taller rectangle. Returned sorted top to bottom, left to right.
+    """
+    rects = []
+    open_runs = {}  # (x, width) -> [x, y, width, height] still growing downwards
+    for y, row in enumerate(matrix):
+        runs = set()
+        x, n = 0, len(row)
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                runs.add((start, x - start))
+            else:
+                x += 1
+        for run in [r for r in open_runs if r not in runs]:
+            rects.append(tuple(open_runs.pop(run)))
+        for run in runs:
+            if run in open_runs:
+                open_runs[run][3] += 1
+            else:
+                open_runs[run] = [run[0], y, run[1], 1]
+    rects.extend(tuple(r) for r in open_runs.values())
+    rects.sort(key=lambda r: (r[1], r[0]))
+    return rects
+
+
+def _num(value):
+    return f'{value:.4f}'.rstrip('0').rstrip('.')
+
+
+def _font_info(font_path, font_size):
+    """
+    (family name, ascent in px) of the label font, as the raster path would load it.
+    """
+    font = load_font(font_path, font_size)
+    family = font.getname()[0] if hasattr(font, 'getname') else None
+    ascent = font.getmetrics()[0] if hasattr(font, 'getmetrics') else font_size
+    return family or 'sans-serif', ascent
+
+
+def _svg(rects, scale, qr_margin, width, height, data, text_top, font_size, font_path):
+    path = ''.join(f'M{x} {y}h{w}v{h}h-{w}z' for x, y, w, h in rects)
+    family, ascent = _font_info(font_path, font_size)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">'
+        f'<rect width="{width}" height="{height}" fill="#fff"/>'
+        f'<path transform="translate({qr_margin} {qr_margin}) scale({_num(scale)})" '
+        f'fill="#000" shape-rendering="crispEdges" d="{path}"/>'
+        f'<text x="{_num(width / 2)}" y="{text_top + ascent}" text-anchor="middle" '
+        f'font-family={quoteattr(family + ", sans-serif")} font-size="{font_size}" '
+        f'fill="#000">{escape(data)}</text>'
+        '</svg>\n'
+    ).encode('utf-8')
+
+
+def _pdf_string(text):
+    text = text.encode('cp1252', 'replace')
+    return b'(' + text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _pdf(rects, scale, qr_margin, width, height, data, text_top, font_size, font_path):
+    _, ascent = _font_info(font_path, font_size)
+    text_w = text_size(data, font_path, font_size)[0]
+    # Module space has its origin at the top left of the quiet zone, y down
+    ops = [f'1 g 0 0 {width} {height} re f',
+           f'q {_num(scale)} 0 0 {_num(-scale)} {qr_margin} {height - qr_margin} cm 0 g']
+    ops += [f'{x} {y} {w} {h} re' for x, y, w, h in rects]
+    ops += ['f Q',
+            f'BT /F1 {font_size} Tf 0 g {_num((width - text_w) / 2)} '
+            f'{height - text_top - ascent} Td ']
+    content = '\n'.join(ops).encode('ascii') + _pdf_string(data) + b' Tj ET'
+
+    buf = io.BytesIO()
+    pdf = PDFFile(buf)
+    font = pdf.add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                   b'/Encoding /WinAnsiEncoding >>')
+    contents = pdf.add(f'<< /Length {len(content)} >>'.encode('ascii'), content)
+    pdf.kids.append(pdf.add(
+        (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] '
+         f'/Contents {contents} 0 R /Resources << /Font << /F1 {font} 0 R >> >> >>')
+        .encode('ascii')))
+    pdf.close()
+    return buf.getvalue()
+
+
+def vector_label(data, out_path=None, fmt='SVG', size=300, qr_margin=0, font_size=14,
+                 font_path=None, text_gap=0, text_margin_bottom=10, border=2,
+                 encoder='fit'):
+    """
+    A labelled QR code as SVG or single-page PDF bytes, laid out like the
+    raster labels: the size x size code (quiet zone of border modules
+    included) inset by qr_margin, with the text centred text_gap below it
+    and text_margin_bottom of space underneath. Units are pixels in SVG and
+    points in PDF.
+
+    Modules become one compact path of merged rectangles (see module_rects)
+    and the label stays real text: SVG names the label font's family, PDF
+    uses the standard Helvetica font (metric-compatible with Arial), so
+    characters outside Windows-1252 show as '?' there. Also usable as a
+    batch engine render function.
+    """
+    fmt = fmt.upper()
+    if fmt not in VECTOR_FORMATS:
+        raise ValueError(f'Unknown vector format {fmt!r}, expected one of {VECTOR_FORMATS}')
+    matrix = make_qr(data, border=border, encoder=encoder).get_matrix()
+    with qr_profile.stage('text.measure'):
+        text_h = text_size(data, font_path, font_size)[1]
+    width = size + qr_margin * 2
+    text_top = width + text_gap
+    height = text_top + text_h + text_margin_bottom
+    write = _svg if fmt == 'SVG' else _pdf
+    with qr_profile.stage('vector'):
+        return write(module_rects(matrix), size / len(matrix), qr_margin, width, height,
+                     data, text_top, font_size, font_path)
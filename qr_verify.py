@@ -0,0 +1,101 @@
+import io
+
+from PIL import Image
+
+import qr_profile
+
+try:
+    import numpy as np
+except ImportError:  # verification needs NumPy; callers check available() first
+    np = None
+
+# Start of every verification error message, for telling them apart in summaries
+FAILED = 'QR check failed'
+VERIFY_MODES = ('image', 'reload')
+
+# Image.info key holding what a label's code should look like (see expect())
+_INFO_KEY = 'qr_verify'
+
+
+class VerificationError(ValueError):
+    pass
+
+
+def available():
+    return np is not None
+
+
+def mismatches(img, expected, size, offset=(0, 0), border=0):
+    """
+    Number of modules whose centre pixel in img has the wrong shade, for a
+    code drawn from the boolean matrix expected (True = dark, border
+    included) at size x size pixels with its top left corner at offset.
+    Modules that fall outside img count as wrong. The border quiet-zone
+    modules on each side are not compared: a negative margin crops them,
+    or lets the background show through.
+
+    A NEAREST resize of the code's box down to one pixel per module picks
+    a pixel inside every module, the same way the renderers spread pixels
+    over modules (see qr_render.module_repeats), so only modules x modules
+    pixels are ever converted for NumPy.
+    """
+    modules = expected.shape[0]
+    x, y = offset
+    width, height = img.size
+    box = (x, y, x + size, y + size)
+    inside = x >= 0 and y >= 0 and box[2] <= width and box[3] <= height
+    if not inside:
+        img, box = img.crop(box), (0, 0, size, size)  # cropping pads with black
+    samples = img.resize((modules, modules), Image.NEAREST, box=box)
+    if samples.mode not in ('1', 'L'):
+        samples = samples.getchannel(0)  # black and white, so one band will do
+    pixels = np.asarray(samples)
+    wrong = (~pixels if pixels.dtype == bool else pixels < 128) != expected
+    if not inside:
+        centers = (2 * np.arange(modules) + 1) * size // (2 * modules)
+        cols = (centers + x >= 0) & (centers + x < width)
+        rows = (centers + y >= 0) & (centers + y < height)
+        wrong |= ~(rows[:, None] & cols)
+    if border:
+        wrong = wrong[border:-border, border:-border]
+    return int(np.count_nonzero(wrong))
+
+
+def _check(img, expected, size, offset, border, what):
+    wrong = mismatches(img, expected, size, offset, border)
+    if wrong:
+        compared = (expected.shape[0] - 2 * border) ** 2
+        raise VerificationError(f'{FAILED}: {wrong} of {compared} modules differ {what}')
+
+
+def expect(img, matrix, size, offset=(0, 0), border=0):
+    """
+    Check a freshly rendered label against the module matrix its code was
+    drawn from (QRCode.get_matrix(), border modules of quiet zone on each
+    side), raising VerificationError on any difference, and remember the
+    expectation for check_encoded().
+    """
+    with qr_profile.stage('verify'):
+        expected = np.asarray(matrix, dtype=bool)
+        _check(img, expected, size, offset, border, 'in the rendered image')
+    img.info[_INFO_KEY] = (expected, size, tuple(offset), border)
+
+
+def check_encoded(payload, img):
+    """
+    Decode payload, the encoded form of img, and check its code against
+    what expect() recorded for img. Images without an expectation and
+    formats Pillow cannot read back (PDF) are passed.
+    """
+    expectation = img.info.get(_INFO_KEY)
+    if expectation is None or payload.startswith(b'%PDF'):
+        return
+    with qr_profile.stage('verify_encoded'):
+        try:
+            with Image.open(io.BytesIO(payload)) as decoded:
+                if decoded.format == 'JPEG':
+                    decoded.draft('L', decoded.size)  # decode the luma only
+                decoded.load()
+                _check(decoded, *expectation, 'in the encoded file')
+        except (OSError, SyntaxError) as e:
+            raise VerificationError(f'{FAILED}: encoded file does not decode ({e})') from None